@@ -0,0 +1,275 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from collections import Counter
+from datetime import datetime
+
+import birthday_checker as bc
+
+# ────────────────────────────────────────────────
+# CẤU HÌNH
+# ────────────────────────────────────────────────
+DEFAULT_SIZES = [100, 10_000, 100_000]
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline_birthday.json')
+# Ngày cố định để số sinh nhật tìm được ổn định giữa các lần chạy
+TARGET_DATE = datetime(2025, 3, 15)
+LEAP_RATIO = 0.02
+SEED = 20250315
+
+# ────────────────────────────────────────────────
+# Google Sheets / Drive giả lập trong process
+# ────────────────────────────────────────────────
+class _Request:
+    def __init__(self, calls, name, result):
+        self.calls = calls
+        self.name = name
+        self.result = result
+
+    def execute(self, **kwargs):
+        self.calls[self.name] += 1
+        return self.result() if callable(self.result) else self.result
+
+class FakeSpreadsheet:
+    def __init__(self, values, calls, revision):
+        self.values_store = values
+        self.calls = calls
+        self.revision = revision
+
+    def apply_batch_update(self, body):
+        for item in body['data']:
+            cells = item['range'].split('!')[1]
+            start, end = cells.split(':')
+            first = int(''.join(c for c in start if c.isdigit()))
+            for offset, new_values in enumerate(item['values']):
+                row = self.values_store[first - 1 + offset]
+                while len(row) < 5:
+                    row.append('')
+                row[3:5] = new_values
+        self.revision[0] += 1
+        return {}
+
+class FakeValues:
+    def __init__(self, sheet):
+        self.sheet = sheet
+
+    def get(self, spreadsheetId, range):
+        return _Request(self.sheet.calls, 'sheets.values.get',
+                        lambda: {'values': [row[:] for row in self.sheet.values_store]})
+
+    def batchGet(self, spreadsheetId, ranges):
+        values = [row[:] for row in self.sheet.values_store]
+        return _Request(self.sheet.calls, 'sheets.values.batchGet',
+                        lambda: {'valueRanges': [{'range': r, 'values': values} for r in ranges]})
+
+    def batchUpdate(self, spreadsheetId, body):
+        return _Request(self.sheet.calls, 'sheets.values.batchUpdate',
+                        lambda: self.sheet.apply_batch_update(body))
+
+class FakeSheetsService:
+    def __init__(self, sheet):
+        self.sheet = sheet
+
+    def spreadsheets(self):
+        sheet = self.sheet
+
+        class _Spreadsheets:
+            def values(self):
+                return FakeValues(sheet)
+        return _Spreadsheets()
+
+class FakeDriveService:
+    def __init__(self, sheet):
+        self.sheet = sheet
+
+    def files(self):
+        sheet = self.sheet
+
+        class _Files:
+            def get(self, fileId, fields, supportsAllDrives=False):
+                return _Request(sheet.calls, 'drive.files.get', lambda: {'version': str(sheet.revision[0])})
+        return _Files()
+
+# ────────────────────────────────────────────────
+# Telegram giả lập
+# ────────────────────────────────────────────────
+class FakeBot:
+    def __init__(self, calls):
+        self.calls = calls
+        # Lần gửi đầu bị 429 → đi qua nhánh RetryAfter + khoá bucket của chat
+        self.rate_limited = False
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        if not self.rate_limited:
+            self.rate_limited = True
+            self.calls['telegram.retry_after'] += 1
+            raise bc._import('telegram.error').RetryAfter(0)
+        self.calls['telegram.sendMessage'] += 1
+
+# Chat riêng + group: group có thêm bucket 20 tin/phút
+BENCH_CHAT_IDS = ['100', '-100']
+
+# ────────────────────────────────────────────────
+# Sheet tổng hợp
+# ────────────────────────────────────────────────
+def make_sheet(size, seed=SEED):
+    rng = random.Random(seed + size)
+    rows = [['Tên', 'Ghi chú', 'Ngày âm', 'Dương năm trước', 'Dương năm nay']]
+    for i in range(size):
+        day = rng.randint(1, 29)
+        month = rng.randint(1, 12)
+        lunar = f"{day}/{month}"
+        if rng.random() < LEAP_RATIO:
+            lunar += rng.choice([' nhuận', '/nhuận'])
+        rows.append([f"Người {i}", '', lunar])
+    return rows
+
+def install_fakes(sheet):
+    bc._SERVICES.clear()
+    bc._SNAPSHOTS.clear()
+    bc._CONTACTS.clear()
+    bc._SERVICES[('sheets', 'v4')] = FakeSheetsService(sheet)
+    bc._SERVICES[('drive', 'v3')] = FakeDriveService(sheet)
+    bc._BOT = FakeBot(sheet.calls)
+    # Giữ nguyên đường token bucket nhưng không chờ theo đồng hồ thật khi đo
+    bc.TELEGRAM_GLOBAL_RATE = 100_000
+    bc.TELEGRAM_CHAT_RATE = 100_000
+    bc.TELEGRAM_GROUP_PER_MINUTE = 6_000_000
+
+async def _flush_outbox(messages, digest):
+    # Bucket giữ asyncio.Lock → tạo mới cho mỗi event loop
+    bc._GLOBAL_BUCKET = None
+    bc._CHAT_BUCKETS.clear()
+    outbox = bc.TelegramOutbox(digest=digest)
+    for message in messages:
+        outbox.add_to(BENCH_CHAT_IDS, message)
+    await outbox.flush()
+
+def _timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - started, result
+
+def _quiet(fn, *args):
+    # Các hàm của checker in log cho từng bước, tắt đi khi đo
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        return fn(*args)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+# ────────────────────────────────────────────────
+# Đo 1 kích thước sheet
+# ────────────────────────────────────────────────
+def bench_size(size):
+    calls = Counter()
+    sheet = FakeSpreadsheet(make_sheet(size), calls, [1])
+    results = {}
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        bc.SHEET_CACHE_DIR = cache_dir
+
+        # Lần chạy đầu: chưa có cache, D,E chưa điền
+        install_fakes(sheet)
+        seconds, _ = _quiet(_timed, bc.update_lunar_solar_dates)
+        results['update_lunar_solar_dates'] = {'seconds': seconds, 'calls': dict(calls)}
+
+        calls.clear()
+        seconds, birthdays = _quiet(_timed, bc.check_birthdays, TARGET_DATE)
+        results['check_birthdays'] = {'seconds': seconds, 'calls': dict(calls), 'found': len(birthdays)}
+
+        calls.clear()
+        seconds, found = _quiet(_timed, bc.birthdays_in_range, TARGET_DATE, 30)
+        results['birthdays_in_range_30'] = {'seconds': seconds, 'calls': dict(calls), 'found': len(found)}
+
+        calls.clear()
+        seconds, events = _quiet(_timed, asyncio.run, bc.check_special_and_cleaning_days())
+        results['check_special_and_cleaning_days'] = {'seconds': seconds, 'calls': dict(calls)}
+
+        # Gửi tin sinh nhật vừa tìm được qua TelegramOutbox: từng tin, rồi gộp digest
+        messages = [message for message, _ in birthdays]
+        for op, digest in (('telegram_flush', False), ('telegram_flush_digest', True)):
+            calls.clear()
+            bc._BOT = FakeBot(calls)
+            seconds, _ = _quiet(_timed, asyncio.run, _flush_outbox(messages, digest))
+            results[op] = {'seconds': seconds, 'calls': dict(calls)}
+
+        # Lần chạy kế: revision đã đổi do lần ghi trên → tải lại 1 lần, không ghi
+        calls.clear()
+        install_fakes(sheet)
+        seconds, _ = _quiet(_timed, bc.update_lunar_solar_dates)
+        results['update_lunar_solar_dates_after_write'] = {'seconds': seconds, 'calls': dict(calls)}
+
+        # Sheet không đổi: đọc từ cache trên đĩa, không tải, không ghi
+        calls.clear()
+        install_fakes(sheet)
+        seconds, _ = _quiet(_timed, bc.update_lunar_solar_dates)
+        results['update_lunar_solar_dates_cached'] = {'seconds': seconds, 'calls': dict(calls)}
+
+    return results
+
+# ────────────────────────────────────────────────
+# So với baseline
+# ────────────────────────────────────────────────
+def compare(results, baseline, tolerance, slack):
+    failures = []
+    for size, ops in results.items():
+        for op, current in ops.items():
+            expected = baseline.get(size, {}).get(op)
+            if expected is None:
+                continue
+            limit = expected['seconds'] * tolerance + slack
+            if current['seconds'] > limit:
+                failures.append(f"{size}/{op}: {current['seconds']:.4f}s > {limit:.4f}s")
+            for name, count in current['calls'].items():
+                if count > expected['calls'].get(name, 0):
+                    failures.append(f"{size}/{op}: {name} {count} calls > {expected['calls'].get(name, 0)}")
+            if 'found' in expected and current.get('found') != expected['found']:
+                failures.append(f"{size}/{op}: found {current.get('found')} != {expected['found']}")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark offline cho birthday_checker')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=2.0, help='Hệ số thời gian cho phép so với baseline')
+    parser.add_argument('--slack', type=float, default=0.01, help='Số giây cộng thêm cho phép (nhiễu đo)')
+    args = parser.parse_args()
+
+    results = {}
+    for size in args.sizes:
+        results[str(size)] = bench_size(size)
+        for op, r in results[str(size)].items():
+            calls = ', '.join(f"{k}={v}" for k, v in sorted(r['calls'].items())) or '-'
+            found = f" found={r['found']}" if 'found' in r else ''
+            print(f"{size:>7} {op:<34} {r['seconds'] * 1000:9.2f} ms  {calls}{found}")
+
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    try:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    except OSError:
+        print("No baseline found, run with --update-baseline first")
+        return 0
+
+    failures = compare(results, baseline, args.tolerance, args.slack)
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    if not failures:
+        print("No regressions against baseline")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
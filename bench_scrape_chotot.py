@@ -0,0 +1,388 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+from collections import Counter
+from contextlib import contextmanager
+from urllib.parse import urlparse, parse_qs
+
+import scrape_chotot as sc
+
+# ────────────────────────────────────────────────
+# CẤU HÌNH
+# ────────────────────────────────────────────────
+DEFAULT_SIZES = [1_000, 10_000, 50_000]
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(HERE, 'bench_fixtures')
+BASELINE_PATH = os.path.join(HERE, 'bench_baseline_scrape.json')
+CARDS_PER_PAGE = 20
+# Số tin mới xuất hiện ở đầu trang 1 trước mỗi lần chạy
+NEW_PER_RUN = 3
+SEED = 20240611
+
+WORDS = ("Đàn Guitar Ukulele Piano Organ Yamaha Casio Kawai Cort Fender Trống Cajon Kalimba Sáo Trúc "
+         "Violin Mic Loa Ampli Boss Pedal Capo Dây Điện Cơ Acoustic Classic Mini Cũ Mới").split()
+SELLERS = 800
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), encoding='utf-8') as f:
+        return f.read()
+
+def fill(template, **values):
+    # Template có JSON ({...}) nên không dùng str.format
+    for key, value in values.items():
+        template = template.replace('{' + key + '}', str(value))
+    return template
+
+# ────────────────────────────────────────────────
+# Chợ Tốt giả lập: trang danh sách / chi tiết dựng từ fixture HTML
+# ────────────────────────────────────────────────
+class FakeSite:
+    def __init__(self, size, seed=SEED):
+        self.rng = random.Random(seed + size)
+        self.listings = {}
+        # Mới nhất đứng đầu, giống sort "tin mới" của Chợ Tốt
+        self.order = []
+        self.next_ad_id = 100_000_000
+        for _ in range(size):
+            self.post()
+        self.page_template = load_fixture('listing_page.html')
+        self.card_template = load_fixture('listing_card.html')
+        self.detail_template = load_fixture('detail_page.html')
+
+    def post(self):
+        self.next_ad_id += 1
+        ad_id = self.next_ad_id
+        rng = self.rng
+        self.listings[ad_id] = {
+            'ad_id': ad_id,
+            'link': f"/mua-ban-nhac-cu-quan-dong-da-ha-noi/{ad_id}.htm",
+            'title': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 7))) + f" {ad_id % 100_000}",
+            'price': f"{rng.randint(1, 21) * 100}.000 đ",
+            'time': f"{rng.randint(1, 59)} phút trước",
+            'location': 'Quận Đống Đa',
+            'seller': f"Người bán {rng.randint(1, SELLERS)}",
+            'views': rng.randint(0, 5000),
+        }
+        self.order.insert(0, ad_id)
+        return ad_id
+
+    def listing_page(self, page):
+        ids = self.order[(page - 1) * CARDS_PER_PAGE:page * CARDS_PER_PAGE]
+        cards = '\n'.join(fill(self.card_template, **self.listings[ad_id]) for ad_id in ids)
+        return fill(self.page_template, cards=cards, total=len(self.order))
+
+    def detail_page(self, ad_id):
+        return fill(self.detail_template, **self.listings[ad_id])
+
+class FakeResponse:
+    def __init__(self, text, status_code=200):
+        self.text = text
+        self.status_code = status_code
+
+    def json(self):
+        return json.loads(self.text)
+
+class FakeSession:
+    def __init__(self, site, calls):
+        self.site = site
+        self.calls = calls
+        self.headers = {}
+
+    def get(self, url, timeout=None):
+        parsed = urlparse(url)
+        if parsed.path.endswith('.htm'):
+            self.calls['http.detail'] += 1
+            ad_id = int(parsed.path.rsplit('/', 1)[1][:-len('.htm')])
+            return FakeResponse(self.site.detail_page(ad_id))
+        self.calls['http.listing'] += 1
+        page = int(parse_qs(parsed.query).get('page', ['1'])[0])
+        return FakeResponse(self.site.listing_page(page))
+
+    def close(self):
+        pass
+
+# ────────────────────────────────────────────────
+# gspread Worksheet giả lập trong bộ nhớ
+# ────────────────────────────────────────────────
+def _a1_row(a1):
+    return int(''.join(c for c in a1 if c.isdigit()))
+
+class FakeWorksheet:
+    def __init__(self, rows, calls):
+        self.rows = [row[:] for row in rows]
+        self.calls = calls
+        self.row_count = max(2000, len(rows))
+        self.col_count = len(sc.HEADERS) + 1
+
+    def get_all_values(self):
+        # Sheets trả giá trị đã định dạng → số thành chuỗi
+        self.calls['sheets.get_all_values'] += 1
+        return [[str(cell) for cell in row] for row in self.rows]
+
+    def row_values(self, row):
+        self.calls['sheets.row_values'] += 1
+        return self.rows[row - 1][:] if row <= len(self.rows) else []
+
+    def _write(self, first, values):
+        for offset, row in enumerate(values):
+            index = first - 1 + offset
+            while len(self.rows) <= index:
+                self.rows.append([])
+            self.rows[index] = list(row)
+
+    def update(self, range_name, values):
+        self.calls['sheets.update'] += 1
+        self._write(_a1_row(range_name.split(':')[0]), values)
+
+    def batch_update(self, data):
+        self.calls['sheets.batch_update'] += 1
+        for item in data:
+            start = item['range'].split(':')[0]
+            if start.rstrip('0123456789') != 'A':
+                raise ValueError(f"Fake chỉ hỗ trợ ghi từ cột A: {item['range']}")
+            self._write(_a1_row(start), item['values'])
+
+    def append_rows(self, values):
+        self.calls['sheets.append_rows'] += 1
+        self.rows.extend(list(row) for row in values)
+        self.row_count = max(self.row_count, len(self.rows))
+
+    def sort(self, *specs, range=None):
+        # sortRange: số < chữ < ô trống, ổn định với các dòng cùng khoá
+        self.calls['sheets.sort'] += 1
+        first, last = (_a1_row(part) for part in range.split(':'))
+
+        def value(cell):
+            if isinstance(cell, (int, float)):
+                return (0, cell, '')
+            return (1, 0, cell.lower()) if cell else (2, 0, '')
+
+        block = self.rows[first - 1:last]
+        block.sort(key=lambda row: tuple(value(row[col - 1] if len(row) >= col else '') for col, _ in specs))
+        self.rows[first - 1:last] = block
+
+    def add_rows(self, n):
+        self.calls['sheets.add_rows'] += 1
+        self.row_count += n
+
+    def batch_clear(self, ranges):
+        self.calls['sheets.batch_clear'] += 1
+        for range_name in ranges:
+            first, last = (_a1_row(part) for part in range_name.split(':'))
+            for index in range(first - 1, min(last, len(self.rows))):
+                self.rows[index] = [''] * len(self.rows[index])
+
+    def clear(self):
+        self.calls['sheets.clear'] += 1
+        self.rows = []
+
+    def resize(self, rows=None, cols=None):
+        self.calls['sheets.resize'] += 1
+        if cols:
+            self.col_count = cols
+
+def make_sheet(site):
+    # Sheet sau 1 lần quét đầy đủ trước đó: Hidden = trang đã thấy, sort Hidden ↑ → STT ↑
+    rows = [sc.HEADERS[:]]
+    for rank, ad_id in enumerate(site.order):
+        item = site.listings[ad_id]
+        page = rank // CARDS_PER_PAGE + 1
+        rows.append([
+            str(rank + 1), item['title'], item['price'], sc.BASE_URL + item['link'], item['time'],
+            item['location'], item['seller'], str(item['views']), str(min(page, sc.MAX_PAGES)),
+        ])
+    return rows
+
+# ────────────────────────────────────────────────
+# Telegram giả lập: thay Session của TelegramSender
+# ────────────────────────────────────────────────
+class FakeTelegramSession:
+    def __init__(self, calls):
+        self.calls = calls
+
+    def post(self, url, data=None, timeout=None):
+        self.calls['telegram.' + url.rsplit('/', 1)[1]] += 1
+        return FakeResponse('{"ok": true, "result": []}')
+
+    def close(self):
+        pass
+
+# Giá trị thật của module, lấy 1 lần lúc import: stub luôn kế thừa lớp thật, không chồng lên stub lần trước
+REAL_TELEGRAM_SENDER = sc.TelegramSender
+REAL_SHEET_WRITER = sc.SheetWriter
+
+class IdleSheetWriter(REAL_SHEET_WRITER):
+    # flush giữa chừng chờ lần ghi xong → số batch_update không phụ thuộc thread nào chạy nhanh hơn
+    def flush(self):
+        super().flush()
+        self.requests.join()
+
+@contextmanager
+def installed_fakes(site, worksheet, calls, db_path, crawl_mode):
+    class StubTelegramSender(REAL_TELEGRAM_SENDER):
+        def __init__(self, token, chat_id):
+            super().__init__(token, chat_id)
+            self.session = FakeTelegramSession(calls)
+
+    patches = {
+        'TelegramSender': StubTelegramSender,
+        'SheetWriter': IdleSheetWriter,
+        'TELEGRAM_GROUP_INTERVAL': 0,
+        'TELEGRAM_CHAT_INTERVAL': 0,
+        'open_spreadsheet': lambda: None,
+        'connect_google_sheet': lambda *args: worksheet,
+        'get_http_session': lambda: FakeSession(site, calls),
+        'LISTINGS_DB': db_path,
+        'JOURNAL_PATH': os.path.join(os.path.dirname(db_path), 'scrape_journal.jsonl'),
+        # 1 search mặc định, không đọc searches.json của thư mục chạy
+        'SEARCHES_PATH': os.path.join(os.path.dirname(db_path), 'searches.json'),
+        'CRAWL_MODE': crawl_mode,
+        'RUN_STATS': sc.RunStats(),
+    }
+    env = {'TELEGRAM_BOT_TOKEN': 'bench', 'TELEGRAM_CHAT_ID': '-100'}
+    saved = {name: getattr(sc, name) for name in patches}
+    saved_env = {name: os.environ.get(name) for name in env}
+    saved_limiters = dict(sc._RATE_LIMITERS)
+    for name, value in patches.items():
+        setattr(sc, name, value)
+    os.environ.update(env)
+    # Không chờ giãn nhịp giữa các trang khi replay
+    sc._RATE_LIMITERS.clear()
+    sc._RATE_LIMITERS[urlparse(sc.START_URL).netloc] = sc.AdaptiveRateLimiter(0, 0, 0)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(sc, name, value)
+        for name, value in saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        sc._RATE_LIMITERS.clear()
+        sc._RATE_LIMITERS.update(saved_limiters)
+
+def _quiet(fn, *args):
+    # scrape_data in log cho từng tin, tắt đi khi đo
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        return fn(*args)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+def run_once(site, worksheet, calls, db_path, crawl_mode):
+    calls.clear()
+    with installed_fakes(site, worksheet, calls, db_path, crawl_mode):
+        started = time.perf_counter()
+        _quiet(sc.scrape_data)
+        # Gửi hết hàng đợi Telegram trong thời gian đo
+        _quiet(sc.close_telegram_sender)
+        seconds = time.perf_counter() - started
+        stats = sc.RUN_STATS
+    pages = [p for p in stats.pages.values() if p.get('status') == 'ok']
+    items = sum(p.get('items', 0) for p in pages)
+    return {
+        'seconds': seconds,
+        'pages': len(pages),
+        'items': items,
+        'pages_per_second': len(pages) / seconds,
+        'items_per_second': items / seconds,
+        'calls': dict(calls),
+        'found': stats.info.get('new', 0),
+    }
+
+# ────────────────────────────────────────────────
+# Đo 1 kích thước sheet
+# ────────────────────────────────────────────────
+def bench_size(size):
+    calls = Counter()
+    site = FakeSite(size)
+    worksheet = FakeWorksheet(make_sheet(site), calls)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        db_path = os.path.join(cache_dir, 'listings.db')
+
+        # Lần đầu: store trống → nạp sheet + chỉ mục gần trùng, quét đủ MAX_PAGES
+        for _ in range(NEW_PER_RUN):
+            site.post()
+        results['cold_full'] = run_once(site, worksheet, calls, db_path, 'auto')
+
+        # Store đã có: quét đủ để cập nhật Views/Hidden
+        for _ in range(NEW_PER_RUN):
+            site.post()
+        results['warm_full'] = run_once(site, worksheet, calls, db_path, 'full')
+
+        # Lần chạy thường: dừng ở trang đầu tiên toàn tin cũ
+        for _ in range(NEW_PER_RUN):
+            site.post()
+        results['incremental'] = run_once(site, worksheet, calls, db_path, 'incremental')
+
+    return results
+
+# ────────────────────────────────────────────────
+# So với baseline
+# ────────────────────────────────────────────────
+def compare(results, baseline, tolerance, slack):
+    failures = []
+    for size, ops in results.items():
+        for op, current in ops.items():
+            expected = baseline.get(size, {}).get(op)
+            if expected is None:
+                continue
+            limit = expected['seconds'] * tolerance + slack
+            if current['seconds'] > limit:
+                failures.append(f"{size}/{op}: {current['seconds']:.4f}s > {limit:.4f}s")
+            for name, count in current['calls'].items():
+                if count > expected['calls'].get(name, 0):
+                    failures.append(f"{size}/{op}: {name} {count} calls > {expected['calls'].get(name, 0)}")
+            if current['found'] != expected['found']:
+                failures.append(f"{size}/{op}: found {current['found']} != {expected['found']}")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark replay offline cho scrape_chotot')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=2.0, help='Hệ số thời gian cho phép so với baseline')
+    parser.add_argument('--slack', type=float, default=0.05, help='Số giây cộng thêm cho phép (nhiễu đo)')
+    args = parser.parse_args()
+
+    results = {}
+    for size in args.sizes:
+        results[str(size)] = bench_size(size)
+        for op, r in results[str(size)].items():
+            calls = ', '.join(f"{k}={v}" for k, v in sorted(r['calls'].items())) or '-'
+            print(f"{size:>7} {op:<12} {r['seconds'] * 1000:10.2f} ms  {r['pages']:>2} pages "
+                  f"{r['pages_per_second']:7.1f} pages/s {r['items_per_second']:8.1f} items/s  "
+                  f"found={r['found']}  {calls}")
+
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    try:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    except OSError:
+        print("No baseline found, run with --update-baseline first")
+        return 0
+
+    failures = compare(results, baseline, args.tolerance, args.slack)
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    if not failures:
+        print("No regressions against baseline")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,19 +1,31 @@
+import time
+_PROCESS_START = time.perf_counter()
+
 import os
-from googleapiclient.discovery import build
-from google.oauth2.service_account import Credentials
-from telegram import Bot
-from telegram.error import BadRequest
-from telegram.constants import ParseMode
-from datetime import datetime, timedelta
+import sys
+import argparse
+import hashlib
+import importlib
+import re
+from datetime import datetime, date, timedelta
+from array import array
+from collections import namedtuple
 import json
 import asyncio
-from lunarcalendar import Converter, Solar, Lunar
 import pytz
 
+# googleapiclient, google.oauth2, telegram, lunarcalendar được import lười
+# (qua _import) chỉ khi nhánh nào đó thật sự cần
+
 # ────────────────────────────────────────────────
 # CẤU HÌNH
 # ────────────────────────────────────────────────
 SHEET_ID = '1nWnCXcKhFh1uRgkcs_qEQCGbZkTdyxL_WD8laSi6kok'
+# Đọc/ghi sheet + đọc "version" của file trên Drive (khoá cache)
+GOOGLE_SCOPES = [
+    'https://www.googleapis.com/auth/spreadsheets',
+    'https://www.googleapis.com/auth/drive.metadata.readonly',
+]
 SHEET_NAME = 'Trang tính1'
 RANGE_NAME = f'{SHEET_NAME}!A:E'
 
@@ -21,44 +33,265 @@ TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')           # Chat chính
 TELEGRAM_CHAT_ID_SPECIAL = os.getenv('TELEGRAM_CHAT_ID_SPECIAL')  # Chat phụ
 
+# Nhiều sheet → nhiều nhóm chat trong 1 lần chạy: JSON trong BIRTHDAY_ROUTES hoặc file BIRTHDAY_CONFIG
+# [{"name": "...", "sheet_id": "...", "sheet_name": "Trang tính1", "chat_ids": [...], "special_chat_ids": [...]}]
+# Không cấu hình → 1 route từ SHEET_ID / TELEGRAM_CHAT_ID / TELEGRAM_CHAT_ID_SPECIAL
+BIRTHDAY_ROUTES = os.getenv('BIRTHDAY_ROUTES')
+BIRTHDAY_CONFIG = os.getenv('BIRTHDAY_CONFIG')
+
+# Gộp mọi tin của 1 chat trong 1 lần chạy thành 1 tin digest
+TELEGRAM_DIGEST = os.getenv('TELEGRAM_DIGEST', '0') == '1'
+# Giới hạn của Telegram: ~30 tin/s toàn bot, 1 tin/s mỗi chat, 20 tin/phút mỗi group
+TELEGRAM_GLOBAL_RATE = 30
+TELEGRAM_CHAT_RATE = 1
+TELEGRAM_GROUP_PER_MINUTE = 20
+TELEGRAM_MAX_RETRIES = 3
+TELEGRAM_MAX_LENGTH = 4096
+
 VN_TIMEZONE = pytz.timezone('Asia/Ho_Chi_Minh')
 
+# Khoảng năm (dương lịch) của bảng âm lịch tra cứu O(1); ngoài khoảng → lunarcalendar
+LUNAR_TABLE_FIRST_YEAR = int(os.getenv('LUNAR_TABLE_FIRST_YEAR', '1900'))
+LUNAR_TABLE_LAST_YEAR = int(os.getenv('LUNAR_TABLE_LAST_YEAR', '2100'))
+
+# Cache snapshot sheet trên đĩa, khoá theo revision của file (Drive "version")
+SHEET_CACHE_DIR = os.getenv('SHEET_CACHE_DIR', '.cache')
+
+# Lịch sự kiện cả năm (JSON + ICS) dựng 1 lần / năm / nội dung cột C
+CALENDAR_DIR = os.getenv('CALENDAR_DIR', os.path.join(SHEET_CACHE_DIR, 'calendar'))
+
+_STARTUP = {'imports': {}, 'main_started': None, 'first_request': None}
+
+_CREDENTIALS = None
+_SERVICES = {}
+_SNAPSHOTS = {}
+
 # ────────────────────────────────────────────────
-# ĐỌC Google Sheet
+# Route: 1 sheet → các chat nhận tin
 # ────────────────────────────────────────────────
-def get_sheet_data():
-    try:
+Route = namedtuple('Route', ['name', 'sheet_id', 'range_name', 'chat_ids', 'special_chat_ids'])
+
+def _as_list(value):
+    if not value:
+        return []
+    return [value] if isinstance(value, (str, int)) else list(value)
+
+_RANGE_START_RE = re.compile(r'^\$?([A-Za-z]*)\$?(\d*)')
+
+def range_start_row(range_name):
+    # 'Trang tính1!A5:E' → 5, 'Trang tính1!A:E' → 1; cột A..E được đọc theo vị trí nên range phải bắt đầu ở cột A
+    cells = range_name.rsplit('!', 1)[-1]
+    column, row = _RANGE_START_RE.match(cells).groups()
+    if column.upper() not in ('', 'A'):
+        raise ValueError(f"Range {range_name!r} must start at column A")
+    return int(row) if row else 1
+
+def load_routes():
+    raw = BIRTHDAY_ROUTES
+    if not raw and BIRTHDAY_CONFIG:
+        with open(BIRTHDAY_CONFIG, encoding='utf-8') as f:
+            raw = f.read()
+    if not raw:
+        return [Route('default', SHEET_ID, RANGE_NAME, _as_list(TELEGRAM_CHAT_ID), _as_list(TELEGRAM_CHAT_ID_SPECIAL))]
+
+    config = json.loads(raw)
+    routes = []
+    for item in config.get('routes', []) if isinstance(config, dict) else config:
+        range_name = item.get('range') or f"{item.get('sheet_name', SHEET_NAME)}!A:E"
+        range_start_row(range_name)
+        routes.append(Route(
+            name=item.get('name') or item['sheet_id'],
+            sheet_id=item['sheet_id'],
+            range_name=range_name,
+            chat_ids=[str(c) for c in _as_list(item.get('chat_ids', TELEGRAM_CHAT_ID))],
+            special_chat_ids=[str(c) for c in _as_list(item.get('special_chat_ids'))],
+        ))
+    return routes
+
+# ────────────────────────────────────────────────
+# Import lười + đo thời gian khởi động
+# ────────────────────────────────────────────────
+def _import(name):
+    module = sys.modules.get(name)
+    if module is None:
+        started = time.perf_counter()
+        module = importlib.import_module(name)
+        _STARTUP['imports'][name] = time.perf_counter() - started
+    return module
+
+def _mark_request(label):
+    if _STARTUP['first_request'] is None:
+        _STARTUP['first_request'] = (label, time.perf_counter() - _PROCESS_START)
+
+def print_startup_profile():
+    main_started = _STARTUP['main_started'] or time.perf_counter()
+    print("── Startup profile ──")
+    print(f"Module import (top-level): {main_started - _PROCESS_START:.3f}s")
+    for name, seconds in _STARTUP['imports'].items():
+        print(f"Lazy import {name}: {seconds:.3f}s")
+    if _STARTUP['first_request']:
+        label, seconds = _STARTUP['first_request']
+        print(f"Time to first request ({label}): {seconds:.3f}s")
+    else:
+        print("Time to first request: no remote request made")
+
+# ────────────────────────────────────────────────
+# Xác thực + build service 1 lần / process
+# ────────────────────────────────────────────────
+def get_google_credentials():
+    global _CREDENTIALS
+    if _CREDENTIALS is None:
         creds_json = os.getenv('GOOGLE_CREDENTIALS')
         creds_dict = json.loads(creds_json)
-        creds = Credentials.from_service_account_info(creds_dict)
-        service = build('sheets', 'v4', credentials=creds)
-        sheet = service.spreadsheets()
-        result = sheet.values().get(spreadsheetId=SHEET_ID, range=RANGE_NAME).execute()
-        data = result.get('values', [])
-        print(f"Sheet data loaded: {len(data)} rows")
-        return data
+        service_account = _import('google.oauth2.service_account')
+        # Có scope sẵn: AuthorizedHttp riêng của từng luồng không đi qua discovery nên không được gán scope mặc định
+        _CREDENTIALS = service_account.Credentials.from_service_account_info(creds_dict, scopes=GOOGLE_SCOPES)
+    return _CREDENTIALS
+
+def get_google_service(api, version):
+    key = (api, version)
+    if key not in _SERVICES:
+        # Discovery document đóng gói sẵn trong google-api-python-client, không tải qua mạng
+        discovery = _import('googleapiclient.discovery')
+        _SERVICES[key] = discovery.build(
+            api, version,
+            credentials=get_google_credentials(),
+            static_discovery=True,
+            cache_discovery=False,
+        )
+    return _SERVICES[key]
+
+def new_authorized_http():
+    # httplib2.Http không thread-safe → mỗi luồng đọc/ghi song song dùng 1 Http riêng
+    auth_httplib2 = _import('google_auth_httplib2')
+    return auth_httplib2.AuthorizedHttp(get_google_credentials(), http=_import('httplib2').Http())
+
+def _execute(request, http=None):
+    return request.execute(http=http) if http is not None else request.execute()
+
+def get_sheet_revision(sheet_id=SHEET_ID, http=None):
+    # Drive tăng "version" mỗi khi file thay đổi → dùng làm khoá cache
+    try:
+        drive = get_google_service('drive', 'v3')
+        meta = _execute(drive.files().get(fileId=sheet_id, fields='version', supportsAllDrives=True), http)
+        _mark_request('drive.files.get')
+        return meta.get('version')
+    except Exception as e:
+        print(f"Could not read sheet revision, cache disabled: {e}")
+        return None
+
+# ────────────────────────────────────────────────
+# Cache snapshot trên đĩa
+# ────────────────────────────────────────────────
+def _snapshot_cache_path(sheet_id, range_name):
+    key = hashlib.sha1(f"{sheet_id}|{range_name}".encode('utf-8')).hexdigest()[:16]
+    return os.path.join(SHEET_CACHE_DIR, f"sheet_{key}.json")
+
+def load_cached_snapshot(sheet_id, range_name):
+    try:
+        with open(_snapshot_cache_path(sheet_id, range_name), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_cached_snapshot(sheet_id, range_name, revision, values):
+    path = _snapshot_cache_path(sheet_id, range_name)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp'
+        # json.dumps dùng encoder C; json.dump(f) thì không
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'revision': revision, 'values': values}, ensure_ascii=False))
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"Could not write sheet cache: {e}")
+
+def invalidate_cached_snapshot(sheet_id, range_name):
+    try:
+        os.remove(_snapshot_cache_path(sheet_id, range_name))
+    except OSError:
+        pass
+
+# ────────────────────────────────────────────────
+# ĐỌC Google Sheet
+# ────────────────────────────────────────────────
+def load_sheet_snapshots(sheet_id, range_names, http=None):
+    # Nạp mọi range của 1 spreadsheet: 1 lần hỏi revision + tối đa 1 lần get/batchGet
+    pending = [r for r in dict.fromkeys(range_names) if (sheet_id, r) not in _SNAPSHOTS]
+    if not pending:
+        return
+    try:
+        revision = get_sheet_revision(sheet_id, http)
+        to_fetch = []
+        for range_name in pending:
+            cached = load_cached_snapshot(sheet_id, range_name) if revision else None
+            if cached and cached.get('revision') == revision:
+                data = cached.get('values', [])
+                _SNAPSHOTS[(sheet_id, range_name)] = data
+                print(f"Sheet data loaded from cache ({range_name}, revision {revision}): {len(data)} rows")
+            else:
+                to_fetch.append(range_name)
+        if not to_fetch:
+            return
+
+        values = get_google_service('sheets', 'v4').spreadsheets().values()
+        if len(to_fetch) == 1:
+            result = _execute(values.get(spreadsheetId=sheet_id, range=to_fetch[0]), http)
+            value_ranges = [result]
+            _mark_request('sheets.values.get')
+        else:
+            result = _execute(values.batchGet(spreadsheetId=sheet_id, ranges=to_fetch), http)
+            value_ranges = result.get('valueRanges', [])
+            _mark_request('sheets.values.batchGet')
+        for range_name, value_range in zip(to_fetch, value_ranges):
+            data = value_range.get('values', [])
+            _SNAPSHOTS[(sheet_id, range_name)] = data
+            print(f"Sheet data loaded ({range_name}): {len(data)} rows")
+            if revision:
+                save_cached_snapshot(sheet_id, range_name, revision, data)
     except Exception as e:
         print(f"Error reading Google Sheet: {e}")
         raise
 
+def get_sheet_data(sheet_id=SHEET_ID, range_name=RANGE_NAME):
+    load_sheet_snapshots(sheet_id, [range_name])
+    return _SNAPSHOTS[(sheet_id, range_name)]
+
+async def prefetch_sheets(routes):
+    # Các spreadsheet khác nhau đọc song song; cùng spreadsheet gộp 1 batchGet
+    by_sheet = {}
+    for route in routes:
+        by_sheet.setdefault(route.sheet_id, []).append(route.range_name)
+    if len(by_sheet) == 1:
+        for sheet_id, range_names in by_sheet.items():
+            load_sheet_snapshots(sheet_id, range_names)
+        return
+    get_google_service('drive', 'v3')
+    get_google_service('sheets', 'v4')
+    results = await asyncio.gather(*(
+        asyncio.to_thread(load_sheet_snapshots, sheet_id, range_names, new_authorized_http())
+        for sheet_id, range_names in by_sheet.items()
+    ), return_exceptions=True)
+    # 1 spreadsheet lỗi không chặn các route khác; route đó đọc lại (và báo lỗi) khi dùng tới
+    for sheet_id, result in zip(by_sheet, results):
+        if isinstance(result, Exception):
+            print(f"Error prefetching sheet {sheet_id}: {result}")
+
 # ────────────────────────────────────────────────
 # GHI Google Sheet
 # ────────────────────────────────────────────────
-def update_sheet_data(values):
+def batch_update_sheet_cells(updates, sheet_id=SHEET_ID, range_name=RANGE_NAME, http=None):
+    # updates: [(a1_range, [[...], ...]), ...] → 1 lần values().batchUpdate
     try:
-        creds_json = os.getenv('GOOGLE_CREDENTIALS')
-        creds_dict = json.loads(creds_json)
-        creds = Credentials.from_service_account_info(creds_dict)
-        service = build('sheets', 'v4', credentials=creds)
-        sheet = service.spreadsheets()
-        body = {'values': values}
-        sheet.values().update(
-            spreadsheetId=SHEET_ID,
-            range=RANGE_NAME,
-            valueInputOption='RAW',
-            body=body
-        ).execute()
-        print("Google Sheet updated successfully")
+        sheet = get_google_service('sheets', 'v4').spreadsheets()
+        body = {
+            'valueInputOption': 'RAW',
+            'data': [{'range': a1, 'values': values} for a1, values in updates],
+        }
+        _execute(sheet.values().batchUpdate(spreadsheetId=sheet_id, body=body), http)
+        # Revision đổi sau khi ghi → bỏ cache cũ
+        invalidate_cached_snapshot(sheet_id, range_name)
+        print(f"Google Sheet updated successfully ({len(updates)} ranges)")
     except Exception as e:
         print(f"Error updating Google Sheet: {e}")
         raise
@@ -66,133 +299,501 @@ def update_sheet_data(values):
 # ────────────────────────────────────────────────
 # GỬI TIN NHẮN TELEGRAM
 # ────────────────────────────────────────────────
-async def send_telegram_message(message, extra_chat_ids=None):
+class TokenBucket:
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def block(self, seconds):
+        # Sau 429: không cấp token nào trong `seconds` giây
+        self.tokens = 0
+        self.updated = max(self.updated, time.monotonic() + seconds)
+
+_BOT = None
+_GLOBAL_BUCKET = None
+_CHAT_BUCKETS = {}
+
+def get_telegram_bot():
+    # 1 Bot + 1 connection pool cho cả lần chạy
+    global _BOT
+    if _BOT is None:
+        telegram = _import('telegram')
+        request = _import('telegram.request').HTTPXRequest(connection_pool_size=16)
+        _BOT = telegram.Bot(token=TELEGRAM_BOT_TOKEN, request=request)
+    return _BOT
+
+async def close_telegram_bot():
+    # Bot chưa initialize() nên đóng thẳng connection pool
+    global _BOT, _GLOBAL_BUCKET
+    if _BOT is not None:
+        await _BOT.request.shutdown()
+        _BOT = None
+    _GLOBAL_BUCKET = None
+    _CHAT_BUCKETS.clear()
+
+def _rate_buckets(chat_id):
+    global _GLOBAL_BUCKET
+    if _GLOBAL_BUCKET is None:
+        _GLOBAL_BUCKET = TokenBucket(TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_RATE)
+    if chat_id not in _CHAT_BUCKETS:
+        buckets = [TokenBucket(TELEGRAM_CHAT_RATE)]
+        if str(chat_id).startswith('-'):  # group / channel
+            buckets.append(TokenBucket(TELEGRAM_GROUP_PER_MINUTE / 60, TELEGRAM_GROUP_PER_MINUTE))
+        _CHAT_BUCKETS[chat_id] = buckets
+    return [_GLOBAL_BUCKET] + _CHAT_BUCKETS[chat_id]
+
+def _retry_after_seconds(value):
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+async def _send_one(bot, chat_id, message):
+    tg_error = _import('telegram.error')
+    parse_mode = _import('telegram.constants').ParseMode.MARKDOWN
+    for attempt in range(TELEGRAM_MAX_RETRIES + 1):
+        for bucket in _rate_buckets(chat_id):
+            await bucket.acquire()
+        try:
+            await bot.send_message(chat_id=chat_id, text=message, parse_mode=parse_mode)
+            _mark_request('telegram.sendMessage')
+            print(f"Sent to {chat_id}: {message[:60]}...")
+            return True
+        except tg_error.RetryAfter as e:
+            wait = _retry_after_seconds(e.retry_after)
+            print(f"Rate limited by Telegram for {chat_id}, retrying in {wait:.0f}s")
+            for bucket in _CHAT_BUCKETS[chat_id]:
+                bucket.block(wait)
+        except tg_error.BadRequest as e:
+            if parse_mode is None:
+                print(f"Error sending to {chat_id}: {e}")
+                return False
+            print(f"Markdown error for {chat_id}, retrying plain: {e}")
+            parse_mode = None
+        except Exception as e:
+            print(f"Error sending to {chat_id}: {e}")
+            return False
+    print(f"Giving up sending to {chat_id} after {TELEGRAM_MAX_RETRIES} retries")
+    return False
+
+def _resolve_chat_ids(extra_chat_ids=None):
     chat_ids = [TELEGRAM_CHAT_ID]
     if extra_chat_ids:
         if isinstance(extra_chat_ids, str):
             chat_ids.append(extra_chat_ids)
         else:
             chat_ids.extend(extra_chat_ids)
+    return [chat_id for chat_id in dict.fromkeys(chat_ids) if chat_id]
 
-    bot = Bot(token=TELEGRAM_BOT_TOKEN)
-    
-    for chat_id in set(chat_ids):
-        if not chat_id:
-            continue
-        try:
-            await bot.send_message(chat_id=chat_id, text=message, parse_mode=ParseMode.MARKDOWN)
-            print(f"Sent to {chat_id}: {message[:60]}...")
-        except BadRequest as e:
-            print(f"Markdown error for {chat_id}, retrying plain: {e}")
-            await bot.send_message(chat_id=chat_id, text=message)
-        except Exception as e:
-            print(f"Error sending to {chat_id}: {e}")
+def _merge_digest(messages):
+    # Gộp theo thứ tự, cắt thành nhiều tin nếu vượt giới hạn độ dài của Telegram
+    chunks = []
+    for message in messages:
+        if chunks and len(chunks[-1]) + 2 + len(message) <= TELEGRAM_MAX_LENGTH:
+            chunks[-1] += "\n\n" + message
+        else:
+            chunks.append(message)
+    return chunks
+
+class TelegramOutbox:
+    # Gom tin theo chat rồi gửi song song giữa các chat (tuần tự trong 1 chat)
+    def __init__(self, digest=None):
+        self.digest = TELEGRAM_DIGEST if digest is None else digest
+        self.pending = {}
+
+    def add(self, message, extra_chat_ids=None):
+        self.add_to(_resolve_chat_ids(extra_chat_ids), message)
+
+    def add_to(self, chat_ids, message):
+        for chat_id in dict.fromkeys(chat_ids):
+            if chat_id:
+                self.pending.setdefault(chat_id, []).append(message)
+
+    async def _send_chat(self, bot, chat_id, messages):
+        if self.digest:
+            messages = _merge_digest(messages)
+        for message in messages:
+            await _send_one(bot, chat_id, message)
+
+    async def flush(self):
+        if not self.pending:
+            return
+        bot = get_telegram_bot()
+        pending, self.pending = self.pending, {}
+        await asyncio.gather(*(self._send_chat(bot, chat_id, messages) for chat_id, messages in pending.items()))
+
+async def send_telegram_message(message, extra_chat_ids=None):
+    outbox = TelegramOutbox(digest=False)
+    outbox.add(message, extra_chat_ids)
+    await outbox.flush()
+
+# ────────────────────────────────────────────────
+# Bảng âm lịch dựng sẵn
+# Mỗi năm âm: (ngày Tết - 1/1 dương) << 17 | tháng nhuận << 13 | bit tháng đủ (30 ngày)
+# Sinh bằng build_lunar_year_info(1899, 2100)
+# ────────────────────────────────────────────────
+_LUNAR_YEAR_INFO_FIRST = 1899
+_LUNAR_YEAR_INFO = (
+    0x500ad5, 0x3d16d2, 0x620752, 0x4c0ea5, 0x38b64a, 0x5c064b, 0x440a9b, 0x309556,
+    0x56056a, 0x400b59, 0x2a5752, 0x500752, 0x3adb25, 0x600b25, 0x480a4b, 0x32b4ab,
+    0x5802ad, 0x42056b, 0x2c4b69, 0x520da9, 0x3efd92, 0x640e92, 0x4c0d25, 0x36ba4d,
+    0x5c0a56, 0x4602b6, 0x2e95b5, 0x5606d4, 0x400ea9, 0x2c5e92, 0x500e92, 0x3acd26,
+    0x5e052b, 0x480a57, 0x32b2b6, 0x580b5a, 0x4406d4, 0x2e6ec9, 0x520749, 0x3cf693,
+    0x620a93, 0x4c052b, 0x34ca5b, 0x5a0aad, 0x46056a, 0x309b55, 0x560ba4, 0x400b49,
+    0x2a5a93, 0x500a95, 0x38f52d, 0x5e0536, 0x480aad, 0x34b5aa, 0x5805b2, 0x420da5,
+    0x2e7d4a, 0x540d4a, 0x3d0a95, 0x600a97, 0x4c0556, 0x36cab5, 0x5a0ad5, 0x4606d2,
+    0x308ea5, 0x560ea5, 0x40064a, 0x286c97, 0x4e0a9b, 0x3af55a, 0x5e056a, 0x480b69,
+    0x34b752, 0x5a0b52, 0x420b25, 0x2c964b, 0x520a4b, 0x3d14ab, 0x6002ad, 0x4a056d,
+    0x36cb69, 0x5c0da9, 0x460d92, 0x309d25, 0x560d25, 0x415a4d, 0x640a56, 0x4e02b6,
+    0x38c5b5, 0x5e06d5, 0x480ea9, 0x34be92, 0x5a0e92, 0x440d26, 0x2c6a56, 0x500a57,
+    0x3d14d6, 0x62035a, 0x4a06d5, 0x36b6c9, 0x5c0749, 0x460693, 0x2e952b, 0x54052b,
+    0x3e0a5b, 0x2a555a, 0x4e056a, 0x38fb55, 0x600ba4, 0x4a0b49, 0x32ba93, 0x580a95,
+    0x42052d, 0x2c8aad, 0x500ab5, 0x3d35aa, 0x6205d2, 0x4c0da5, 0x36dd4a, 0x5c0d4a,
+    0x460c95, 0x30952e, 0x540556, 0x3e0ab5, 0x2a55b2, 0x5006d2, 0x38cea5, 0x5e0725,
+    0x48064b, 0x32ac97, 0x560cab, 0x42055a, 0x2c6ad6, 0x520b69, 0x3d7752, 0x620b52,
+    0x4c0b25, 0x36da4b, 0x5a0a4b, 0x4404ab, 0x2ea55b, 0x5405ad, 0x3e0b6a, 0x2a5b52,
+    0x500d92, 0x3afd25, 0x5e0d25, 0x480a55, 0x32b4ad, 0x5804b6, 0x4005b5, 0x2c6daa,
+    0x520ec9, 0x3f1e92, 0x620e92, 0x4c0d26, 0x36ca56, 0x5a0a57, 0x4404d6, 0x2e86d5,
+    0x540755, 0x400749, 0x286e93, 0x4e0693, 0x38f52b, 0x5e052b, 0x460a5b, 0x32b55a,
+    0x58056a, 0x420b65, 0x2c974a, 0x520b4a, 0x3d1a95, 0x620a95, 0x4a052d, 0x34caad,
+    0x5a0ab5, 0x4605aa, 0x2e8ba5, 0x540da5, 0x400d4a, 0x2a7c95, 0x4e0c96, 0x38f94e,
+    0x5e0556, 0x480ab5, 0x32b5b2, 0x5806d2, 0x420ea5, 0x2e8e4a, 0x50064b, 0x3b0c97,
+    0x6004ab, 0x4a055b, 0x34cad6, 0x5a0b6a, 0x460752, 0x309725, 0x540b25, 0x3e0a8b,
+    0x28549b, 0x4e04ab,
+)
+
+def _lunarcalendar():
+    return _import('lunarcalendar.converter')
+
+def build_lunar_year_info(first_year, last_year):
+    lc = _lunarcalendar()
+    info = []
+    for year in range(first_year, last_year + 1):
+        new_year = lc.Converter.Lunar2Solar(lc.Lunar(year, 1, 1, isleap=False, check=False))
+        d = date(new_year.year, new_year.month, new_year.day)
+        offset = (d - date(year, 1, 1)).days
+        bits = leap = 0
+        slot = -1
+        while True:
+            lunar = lc.Converter.Solar2Lunar(lc.Solar(d.year, d.month, d.day))
+            if lunar.year != year:
+                break
+            if lunar.day == 1:
+                slot += 1
+                if lunar.isleap:
+                    leap = lunar.month
+            if lunar.day == 30:
+                bits |= 1 << slot
+            d += timedelta(days=1)
+        info.append(offset << 17 | leap << 13 | bits)
+    return info
+
+class LunarTable:
+    # days[ordinal - base]: (năm âm - first_year) << 10 | tháng << 6 | nhuận << 5 | ngày
+    # month_start/month_len[(năm - first_year) * 26 + (tháng - 1) * 2 + nhuận]
+    def __init__(self, first_year, year_info):
+        self.first_year = first_year
+        self.last_year = first_year + len(year_info) - 1
+        self.base = date(first_year, 1, 1).toordinal() + (year_info[0] >> 17)
+        self.days = array('I')
+        self.month_start = array('I', bytes(4 * 26 * len(year_info)))
+        self.month_len = array('B', bytes(26 * len(year_info)))
+
+        for y, packed in enumerate(year_info):
+            leap = (packed >> 13) & 0xF
+            months = []
+            for m in range(1, 13):
+                months.append((m, 0))
+                if m == leap:
+                    months.append((m, 1))
+            for slot, (m, is_leap) in enumerate(months):
+                length = 30 if packed >> slot & 1 else 29
+                key = y * 26 + (m - 1) * 2 + is_leap
+                self.month_start[key] = len(self.days) + 1
+                self.month_len[key] = length
+                head = y << 10 | m << 6 | is_leap << 5
+                self.days.extend(head | d for d in range(1, length + 1))
+
+    def solar_to_lunar(self, solar_date):
+        idx = date(solar_date.year, solar_date.month, solar_date.day).toordinal() - self.base
+        if not 0 <= idx < len(self.days):
+            return None
+        packed = self.days[idx]
+        return packed & 0x1F, (packed >> 6) & 0xF, bool(packed & 0x20)
+
+    def lunar_to_solar(self, lunar_day, lunar_month, lunar_year, is_leap=False):
+        if not self.first_year <= lunar_year <= self.last_year or not 1 <= lunar_month <= 12:
+            return None
+        key = (lunar_year - self.first_year) * 26 + (lunar_month - 1) * 2 + int(bool(is_leap))
+        start = self.month_start[key]
+        if not start or not 1 <= lunar_day <= self.month_len[key]:
+            return None
+        return datetime.fromordinal(self.base + start - 2 + lunar_day)
+
+_LUNAR_TABLE = None
+
+def get_lunar_table():
+    global _LUNAR_TABLE
+    if _LUNAR_TABLE is None:
+        # Năm âm trước năm đầu cũng cần (tháng 1-2 dương thuộc năm âm cũ)
+        first, last = LUNAR_TABLE_FIRST_YEAR - 1, LUNAR_TABLE_LAST_YEAR
+        shipped_last = _LUNAR_YEAR_INFO_FIRST + len(_LUNAR_YEAR_INFO) - 1
+        if _LUNAR_YEAR_INFO_FIRST <= first and last <= shipped_last:
+            info = _LUNAR_YEAR_INFO[first - _LUNAR_YEAR_INFO_FIRST:last - _LUNAR_YEAR_INFO_FIRST + 1]
+        else:
+            info = build_lunar_year_info(first, last)
+        _LUNAR_TABLE = LunarTable(first, info)
+    return _LUNAR_TABLE
+
+def _in_table_range(year):
+    return LUNAR_TABLE_FIRST_YEAR <= year <= LUNAR_TABLE_LAST_YEAR
 
 # ────────────────────────────────────────────────
 # Âm → Dương
 # ────────────────────────────────────────────────
 def convert_lunar_to_solar(lunar_day, lunar_month, target_year, is_leap=False):
+    if _in_table_range(target_year):
+        solar = get_lunar_table().lunar_to_solar(lunar_day, lunar_month, target_year, is_leap)
+        if solar is None:
+            print(f"Error converting lunar {lunar_day}/{lunar_month}/{target_year} (leap={is_leap}): date doesn't exist")
+        return solar
+    lc = _lunarcalendar()
     try:
-        lunar = Lunar(target_year, lunar_month, lunar_day, isleap=is_leap)
-        solar = Converter.Lunar2Solar(lunar)
+        lunar = lc.Lunar(target_year, lunar_month, lunar_day, isleap=is_leap)
+        solar = lc.Converter.Lunar2Solar(lunar)
         return datetime(solar.year, solar.month, solar.day)
-    except ValueError as e:
+    except (ValueError, lc.DateNotExist) as e:
         print(f"Error converting lunar {lunar_day}/{lunar_month}/{target_year} (leap={is_leap}): {e}")
         return None
 
+def convert_lunar_to_solar_many(lunar_dates, target_year):
+    # lunar_dates: [(ngày, tháng, nhuận), ...] → [datetime | None, ...]
+    if not _in_table_range(target_year):
+        return [convert_lunar_to_solar(d, m, target_year, leap) for d, m, leap in lunar_dates]
+    table = get_lunar_table()
+    return [table.lunar_to_solar(d, m, target_year, leap) for d, m, leap in lunar_dates]
+
 # ────────────────────────────────────────────────
 # Dương → Âm
 # ────────────────────────────────────────────────
 def convert_solar_to_lunar(solar_date):
+    if _in_table_range(solar_date.year):
+        return get_lunar_table().solar_to_lunar(solar_date) or (None, None, None)
     try:
-        solar = Solar(solar_date.year, solar_date.month, solar_date.day)
-        lunar = Converter.Solar2Lunar(solar)
+        lc = _lunarcalendar()
+        solar = lc.Solar(solar_date.year, solar_date.month, solar_date.day)
+        lunar = lc.Converter.Solar2Lunar(solar)
         return lunar.day, lunar.month, lunar.isleap
     except Exception as e:
         print(f"Error converting solar {solar_date} to lunar: {e}")
         return None, None, None
 
+def convert_solar_to_lunar_many(solar_dates):
+    # [date, ...] → [(ngày, tháng, nhuận), ...]
+    return [convert_solar_to_lunar(d) for d in solar_dates]
+
+# ────────────────────────────────────────────────
+# Danh bạ: parse cột C 1 lần + index theo (ngày âm, tháng âm, nhuận)
+# ────────────────────────────────────────────────
+Contact = namedtuple('Contact', ['row', 'name', 'lunar_day', 'lunar_month', 'is_leap'])
+
+_LUNAR_DATE_RE = re.compile(r'^\s*(\d{1,2})\s*/\s*(\d{1,2})')
+
+def parse_lunar_date(text):
+    # "22/12", "15/8 nhuận", "15/8/nhuận" → (15, 8, True); sai định dạng → None
+    match = _LUNAR_DATE_RE.match(text)
+    if not match:
+        return None
+    return int(match.group(1)), int(match.group(2)), 'nhuận' in text.lower()
+
+def parse_contacts(data):
+    contacts = []
+    for i, row in enumerate(data[1:], start=1):
+        if len(row) < 3 or not row[2].strip():
+            continue
+        lunar = parse_lunar_date(row[2])
+        if lunar is None:
+            continue
+        contacts.append(Contact(i, row[0].strip(), *lunar))
+    return contacts
+
+def build_birthday_index(contacts):
+    index = {}
+    for contact in contacts:
+        key = (contact.lunar_day, contact.lunar_month, contact.is_leap)
+        index.setdefault(key, []).append(contact)
+    return index
+
+_CONTACTS = {}
+
+def get_contacts(sheet_id=SHEET_ID, range_name=RANGE_NAME):
+    # Trả (contacts, index), dựng lại chỉ khi snapshot đổi
+    data = get_sheet_data(sheet_id, range_name)
+    key = (sheet_id, range_name)
+    cached = _CONTACTS.get(key)
+    if cached is None or cached[0] is not data:
+        contacts = parse_contacts(data)
+        cached = (data, contacts, build_birthday_index(contacts))
+        _CONTACTS[key] = cached
+    return cached[1], cached[2]
+
+def lunar_targets(start, days):
+    # [(ngày dương, (ngày, tháng, nhuận)), ...] — tính 1 lần, dùng chung cho mọi sheet
+    dates = [start + timedelta(days=i) for i in range(days)]
+    return [(d, lunar) for d, lunar in zip(dates, convert_solar_to_lunar_many(dates)) if lunar[0] is not None]
+
+def birthdays_for_targets(targets, sheet_id=SHEET_ID, range_name=RANGE_NAME):
+    _, index = get_contacts(sheet_id, range_name)
+    results = []
+    for solar_date, lunar in targets:
+        for contact in index.get(lunar, ()):
+            results.append((solar_date, lunar, contact))
+    return results
+
+def birthdays_in_range(start, days, sheet_id=SHEET_ID, range_name=RANGE_NAME):
+    # [(ngày dương, (ngày, tháng, nhuận), Contact), ...] trong [start, start + days)
+    return birthdays_for_targets(lunar_targets(start, days), sheet_id, range_name)
+
+# ────────────────────────────────────────────────
+# Trạng thái lần ghi D,E trước (fingerprint cột C + năm)
+# ────────────────────────────────────────────────
+def contacts_fingerprint(contacts):
+    digest = hashlib.sha1()
+    for c in contacts:
+        digest.update(f"{c.row}:{c.lunar_day}/{c.lunar_month}/{int(c.is_leap)};".encode('utf-8'))
+    return digest.hexdigest()
+
+def calendar_fingerprint(contacts):
+    # Lịch lưu cả tên → đổi tên / đổi chỗ 2 người cùng ngày cũng phải dựng lại
+    digest = hashlib.sha1()
+    for c in contacts:
+        digest.update(f"{c.row}:{c.name}:{c.lunar_day}/{c.lunar_month}/{int(c.is_leap)};".encode('utf-8'))
+    return digest.hexdigest()
+
+def _lunar_state_path(sheet_id, range_name):
+    return _snapshot_cache_path(sheet_id, range_name)[:-len('.json')] + '.dates.json'
+
+def load_lunar_state(sheet_id, range_name):
+    try:
+        with open(_lunar_state_path(sheet_id, range_name), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_lunar_state(sheet_id, range_name, state):
+    path = _lunar_state_path(sheet_id, range_name)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+    except OSError as e:
+        print(f"Could not write lunar date state: {e}")
+
+def _row_ranges(rows):
+    # [3, 4, 5, 9] → [(3, 5), (9, 9)]
+    ranges = []
+    for row in rows:
+        if ranges and ranges[-1][1] == row - 1:
+            ranges[-1] = (ranges[-1][0], row)
+        else:
+            ranges.append((row, row))
+    return ranges
+
 # ────────────────────────────────────────────────
 # Cập nhật cột D,E (dương lịch từ âm lịch) - vẫn giữ để tham khảo
 # ────────────────────────────────────────────────
-def update_lunar_solar_dates():
+def _format_solar(solar):
+    # = strftime('%d/%m/%Y'), nhanh hơn nhiều khi chạy cho cả cột
+    return f"{solar.day:02d}/{solar.month:02d}/{solar.year}" if solar else ''
+
+def update_lunar_solar_dates(sheet_id=SHEET_ID, range_name=RANGE_NAME, http=None):
     now = datetime.now(VN_TIMEZONE)
     current_year = now.year
     previous_year = current_year - 1
-    data = get_sheet_data()
-    updated_data = [row[:] for row in data]  # deep copy
-    updated = False
+    data = get_sheet_data(sheet_id, range_name)
+    contacts, _ = get_contacts(sheet_id, range_name)
 
-    for i, row in enumerate(data[1:], start=1):
-        if len(row) <= 2 or not row[2].strip():
-            continue
-        lunar_str = row[2].strip()
-        try:
-            parts = lunar_str.split('/')
-            lunar_day = int(parts[0])
-            lunar_month = int(parts[1])
-            is_leap = False
-            if len(parts) > 2 and 'nhuận' in parts[2].lower():
-                is_leap = True
-
-            # Năm trước
-            solar_prev = convert_lunar_to_solar(lunar_day, lunar_month, previous_year, is_leap)
-            # Năm nay
-            solar_curr = convert_lunar_to_solar(lunar_day, lunar_month, current_year, is_leap)
-
-            while len(updated_data[i]) < 5:
-                updated_data[i].append('')
-
-            prev_str = solar_prev.strftime('%d/%m/%Y') if solar_prev else ''
-            curr_str = solar_curr.strftime('%d/%m/%Y') if solar_curr else ''
-
-            if updated_data[i][3] != prev_str or updated_data[i][4] != curr_str:
-                updated_data[i][3] = prev_str
-                updated_data[i][4] = curr_str
-                updated = True
-        except Exception:
-            continue
+    # Cột C và năm không đổi từ lần trước → D,E đã đúng, bỏ qua
+    state = {'fingerprint': contacts_fingerprint(contacts), 'year': current_year}
+    if load_lunar_state(sheet_id, range_name) == state:
+        print("Column C unchanged since last run, skipping lunar date update")
+        return
+
+    lunar_dates = [(c.lunar_day, c.lunar_month, c.is_leap) for c in contacts]
+    # Năm trước / năm nay — mỗi năm 1 lần tra bảng cho cả cột
+    solar_prevs = convert_lunar_to_solar_many(lunar_dates, previous_year)
+    solar_currs = convert_lunar_to_solar_many(lunar_dates, current_year)
+
+    changed = {}
+    for contact, solar_prev, solar_curr in zip(contacts, solar_prevs, solar_currs):
+        row = data[contact.row]
+        prev_str = _format_solar(solar_prev)
+        curr_str = _format_solar(solar_curr)
+        old_prev = row[3] if len(row) > 3 else ''
+        old_curr = row[4] if len(row) > 4 else ''
+        if old_prev != prev_str or old_curr != curr_str:
+            changed[contact.row] = [prev_str, curr_str]
 
-    if updated:
-        update_sheet_data(updated_data)
+    if changed:
+        sheet_prefix = range_name.rsplit('!', 1)[0]
+        start_row = range_start_row(range_name)
+        updates = []
+        for first, last in _row_ranges(sorted(changed)):
+            # Chỉ số dòng trong data bắt đầu từ 0 tại dòng đầu của range → dòng sheet = i + start_row
+            a1 = f"{sheet_prefix}!D{first + start_row}:E{last + start_row}"
+            updates.append((a1, [changed[i] for i in range(first, last + 1)]))
+        batch_update_sheet_cells(updates, sheet_id, range_name, http)
+        for i, values in changed.items():
+            row = data[i]
+            while len(row) < 5:
+                row.append('')
+            row[3:5] = values
+        print(f"Updated lunar dates for {len(changed)} rows")
     else:
         print("No updates needed for lunar dates")
+    save_lunar_state(sheet_id, range_name, state)
+
+async def update_all_lunar_solar_dates(routes):
+    targets = list(dict.fromkeys((r.sheet_id, r.range_name) for r in routes))
+    if len(targets) == 1:
+        update_lunar_solar_dates(*targets[0])
+        return
+    results = await asyncio.gather(*(
+        asyncio.to_thread(update_lunar_solar_dates, sheet_id, range_name, new_authorized_http())
+        for sheet_id, range_name in targets
+    ), return_exceptions=True)
+    # 1 sheet lỗi không chặn các sheet khác
+    for (sheet_id, range_name), result in zip(targets, results):
+        if isinstance(result, Exception):
+            print(f"Error updating lunar dates for {sheet_id} {range_name}: {result}")
 
 # ────────────────────────────────────────────────
 # Kiểm tra sinh nhật hôm nay / mai (sửa: so sánh âm lịch trực tiếp)
 # ────────────────────────────────────────────────
-def check_birthdays(target_date, is_tomorrow=False):
-    lunar_day, lunar_month, is_leap = convert_solar_to_lunar(target_date)
-    if lunar_day is None:
-        return []
+def _birthday_message(name, solar_date, lunar, is_tomorrow):
+    lunar_day, lunar_month, is_leap = lunar
+    leap_text = " (nhuận)" if is_leap else ""
+    solar_str = solar_date.strftime('%d/%m/%Y')
+    return (
+        f"**{name} sinh nhật {'ngày mai' if is_tomorrow else 'hôm nay'}:**\n"
+        f"Theo ngày âm: {lunar_day}/{lunar_month}{leap_text} - {solar_str} dương lịch"
+    )
 
-    # Chuẩn hóa dạng "ngày/tháng" (ví dụ: "22/12")
-    target_lunar = f"{lunar_day}/{lunar_month}"
-
-    data = get_sheet_data()
+def check_birthdays(target_date, is_tomorrow=False, sheet_id=SHEET_ID, range_name=RANGE_NAME):
     birthdays = []
-
-    for row in data[1:]:
-        if len(row) < 3 or not row[2].strip():
-            continue
-        name = row[0].strip()
-        lunar_in_sheet = row[2].strip()  # ví dụ: "22/12" hoặc "15/8 nhuận"
-
-        # Xử lý tháng nhuận nếu sheet ghi "ngày/tháng nhuận"
-        is_leap_sheet = False
-        if 'nhuận' in lunar_in_sheet.lower():
-            is_leap_sheet = True
-            lunar_in_sheet = lunar_in_sheet.split('nhuận')[0].strip()
-
-        if lunar_in_sheet == target_lunar and is_leap_sheet == is_leap:
-            leap_text = " (nhuận)" if is_leap else ""
-            solar_str = target_date.strftime('%d/%m/%Y')
-            msg = (
-                f"**{name} sinh nhật {'ngày mai' if is_tomorrow else 'hôm nay'}:**\n"
-                f"Theo ngày âm: {lunar_in_sheet}{leap_text} - {solar_str} dương lịch"
-            )
-            birthdays.append((msg, name))
-
+    for solar_date, lunar, contact in birthdays_in_range(target_date, 1, sheet_id, range_name):
+        birthdays.append((_birthday_message(contact.name, solar_date, lunar, is_tomorrow), contact.name))
     return birthdays
 
 # ────────────────────────────────────────────────
@@ -228,39 +829,198 @@ async def check_special_and_cleaning_days():
 
     return messages
 
+# ────────────────────────────────────────────────
+# Lịch sự kiện cả năm: sinh nhật, mùng 1/rằm, dọn bàn thờ → JSON + ICS
+# ────────────────────────────────────────────────
+def build_event_calendar(year, sheet_id=SHEET_ID, range_name=RANGE_NAME):
+    # 1 lượt tra bảng cho cả 365/366 ngày, 1 lần probe index mỗi ngày
+    start = date(year, 1, 1)
+    targets = lunar_targets(start, (date(year + 1, 1, 1) - start).days)
+    events = {}
+    for solar_date, (lunar_day, lunar_month, is_leap) in targets:
+        lunar = {'lunar_day': lunar_day, 'lunar_month': lunar_month, 'is_leap': is_leap}
+        if lunar_day in (1, 15):
+            event = "mùng 1" if lunar_day == 1 else "rằm"
+            events.setdefault(solar_date.isoformat(), []).append({'type': 'special', 'event': event, **lunar})
+        if lunar_day in (4, 18):
+            events.setdefault(solar_date.isoformat(), []).append({'type': 'cleaning', **lunar})
+    for solar_date, (lunar_day, lunar_month, is_leap), contact in birthdays_for_targets(targets, sheet_id, range_name):
+        events.setdefault(solar_date.isoformat(), []).append({
+            'type': 'birthday', 'name': contact.name,
+            'lunar_day': lunar_day, 'lunar_month': lunar_month, 'is_leap': is_leap,
+        })
+    contacts, _ = get_contacts(sheet_id, range_name)
+    return {
+        'year': year,
+        'sheet_id': sheet_id,
+        'range': range_name,
+        'fingerprint': calendar_fingerprint(contacts),
+        'events': dict(sorted(events.items())),
+    }
+
+def _event_summary(event):
+    leap_text = " (nhuận)" if event['is_leap'] else ""
+    lunar = f"{event['lunar_day']}/{event['lunar_month']}{leap_text}"
+    if event['type'] == 'birthday':
+        return f"Sinh nhật {event['name']} ({lunar} âm lịch)"
+    if event['type'] == 'special':
+        return f"{event['event'].capitalize()} tháng {event['lunar_month']}{leap_text} âm lịch"
+    base = "mùng 1" if event['lunar_day'] == 4 else "rằm"
+    return f"Dọn bàn thờ (sau {base} 3 ngày, {lunar} âm lịch)"
+
+def _ics_escape(text):
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+def _ics_fold(line):
+    # RFC 5545: mỗi dòng tối đa 75 octet, dòng tiếp theo bắt đầu bằng 1 dấu cách
+    data = line.encode('utf-8')
+    if len(data) <= 75:
+        return line
+    parts, chunk, limit = [], b'', 75
+    for ch in line:
+        encoded = ch.encode('utf-8')
+        if len(chunk) + len(encoded) > limit:
+            parts.append(chunk.decode('utf-8'))
+            chunk, limit = b'', 74
+        chunk += encoded
+    parts.append(chunk.decode('utf-8'))
+    return '\r\n '.join(parts)
+
+def event_calendar_to_ics(calendar, name):
+    stamp = datetime.now(pytz.utc).strftime('%Y%m%dT%H%M%SZ')
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//birthday_checker//lunar events//VI',
+        'CALSCALE:GREGORIAN',
+        f"X-WR-CALNAME:{_ics_escape(name)} {calendar['year']}",
+    ]
+    for day, events in calendar['events'].items():
+        start = date.fromisoformat(day)
+        for event in events:
+            summary = _event_summary(event)
+            uid = hashlib.sha1(f"{day}|{summary}".encode('utf-8')).hexdigest()[:20]
+            lines += [
+                'BEGIN:VEVENT',
+                f"UID:{uid}@birthday-checker",
+                f"DTSTAMP:{stamp}",
+                f"DTSTART;VALUE=DATE:{start.strftime('%Y%m%d')}",
+                f"DTEND;VALUE=DATE:{(start + timedelta(days=1)).strftime('%Y%m%d')}",
+                f"SUMMARY:{_ics_escape(summary)}",
+                'TRANSP:TRANSPARENT',
+                'END:VEVENT',
+            ]
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(_ics_fold(line) for line in lines) + '\r\n'
+
+def _calendar_path(route, year, ext, calendar_dir=None):
+    slug = re.sub(r'[^0-9A-Za-z_-]+', '-', route.name).strip('-') or 'calendar'
+    return os.path.join(calendar_dir or CALENDAR_DIR, f"{slug}-{year}.{ext}")
+
+def write_event_calendar(route, calendar, calendar_dir=None):
+    json_path = _calendar_path(route, calendar['year'], 'json', calendar_dir)
+    os.makedirs(os.path.dirname(json_path), exist_ok=True)
+    with open(json_path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(calendar, ensure_ascii=False, indent=1))
+    with open(_calendar_path(route, calendar['year'], 'ics', calendar_dir), 'w', encoding='utf-8', newline='') as f:
+        f.write(event_calendar_to_ics(calendar, route.name))
+    return json_path
+
+def ensure_event_calendar(route, year):
+    # Dùng lại file đã dựng nếu cùng năm + cùng fingerprint cột A, C, không thì dựng lại
+    contacts, _ = get_contacts(route.sheet_id, route.range_name)
+    fingerprint = calendar_fingerprint(contacts)
+    try:
+        with open(_calendar_path(route, year, 'json'), encoding='utf-8') as f:
+            calendar = json.load(f)
+        if calendar.get('fingerprint') == fingerprint and calendar.get('year') == year:
+            return calendar
+    except (OSError, ValueError):
+        pass
+    calendar = build_event_calendar(year, route.sheet_id, route.range_name)
+    try:
+        write_event_calendar(route, calendar)
+        print(f"Event calendar {year} rebuilt for {route.name}")
+    except OSError as e:
+        print(f"Could not write event calendar: {e}")
+    return calendar
+
+def calendar_entries(calendars, solar_date, event_type):
+    calendar = calendars.get(solar_date.year)
+    if not calendar:
+        return []
+    key = date(solar_date.year, solar_date.month, solar_date.day).isoformat()
+    return [e for e in calendar['events'].get(key, []) if e['type'] == event_type]
+
+async def export_calendars(year, calendar_dir=None):
+    routes = load_routes()
+    await prefetch_sheets(routes)
+    for route in routes:
+        calendar = build_event_calendar(year, route.sheet_id, route.range_name)
+        path = write_event_calendar(route, calendar, calendar_dir)
+        count = sum(len(events) for events in calendar['events'].values())
+        print(f"Exported {count} events for {route.name} → {path} (+ .ics)")
+
 # ────────────────────────────────────────────────
 # HÀM CHÍNH
 # ────────────────────────────────────────────────
-async def main():
+async def main(profile_startup=False):
+    _STARTUP['main_started'] = time.perf_counter()
     now = datetime.now(VN_TIMEZONE)
     print(f"Script started at {now.strftime('%Y-%m-%d %H:%M:%S %Z')}")
 
+    routes = load_routes()
+    print(f"{len(routes)} route(s): {', '.join(r.name for r in routes)}")
+    await prefetch_sheets(routes)
+
     # Cập nhật ngày dương từ âm (tham khảo)
-    update_lunar_solar_dates()
+    await update_all_lunar_solar_dates(routes)
 
     today = now
     tomorrow = today + timedelta(days=1)
 
-    # Sinh nhật
-    today_birthdays = check_birthdays(today, is_tomorrow=False)
-    tomorrow_birthdays = check_birthdays(tomorrow, is_tomorrow=True)
-
-    for msg, _ in today_birthdays:
-        await send_telegram_message(msg)
-    for msg, _ in tomorrow_birthdays:
-        await send_telegram_message(msg)
+    # Sinh nhật: tra lịch sự kiện cả năm (dựng lại chỉ khi cột C hoặc năm đổi)
+    outbox = TelegramOutbox()
+    found_birthdays = False
+    for route in routes:
+        try:
+            calendars = {y: ensure_event_calendar(route, y) for y in {today.year, tomorrow.year}}
+        except Exception as e:
+            print(f"Error checking birthdays for {route.name}: {e}")
+            continue
+        for solar_date in (today, tomorrow):
+            for event in calendar_entries(calendars, solar_date, 'birthday'):
+                lunar = (event['lunar_day'], event['lunar_month'], event['is_leap'])
+                msg = _birthday_message(event['name'], solar_date, lunar, solar_date is tomorrow)
+                outbox.add_to(route.chat_ids, msg)
+                found_birthdays = True
 
-    # Mùng 1/rằm + dọn bàn thờ
+    # Mùng 1/rằm + dọn bàn thờ: giống nhau cho mọi route → gửi tới chat chính + chat phụ của tất cả
     events = await check_special_and_cleaning_days()
+    event_chat_ids = [c for r in routes for c in r.chat_ids + r.special_chat_ids]
+    for _, msg in events:
+        outbox.add_to(event_chat_ids, msg)
 
-    for event_type, msg in events:
-        if event_type == "special":
-            await send_telegram_message(msg, extra_chat_ids=TELEGRAM_CHAT_ID_SPECIAL)
-        else:
-            await send_telegram_message(msg, extra_chat_ids=TELEGRAM_CHAT_ID_SPECIAL)
+    try:
+        await outbox.flush()
+    finally:
+        await close_telegram_bot()
 
-    if not today_birthdays and not tomorrow_birthdays and not events:
+    if not found_birthdays and not events:
         print("Không có sự kiện nào trong vài ngày tới.")
 
+    if profile_startup:
+        print_startup_profile()
+
 if __name__ == '__main__':
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description='Nhắc sinh nhật âm lịch, mùng 1/rằm qua Telegram')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='In thời gian import và thời gian tới request đầu tiên')
+    parser.add_argument('--export-calendar', type=int, nargs='?', const=datetime.now(VN_TIMEZONE).year,
+                        metavar='YEAR', help='Xuất lịch sự kiện cả năm (JSON + ICS) rồi thoát')
+    parser.add_argument('--calendar-dir', default=None, help=f'Thư mục xuất lịch (mặc định {CALENDAR_DIR})')
+    args = parser.parse_args()
+    if args.export_calendar:
+        asyncio.run(export_calendars(args.export_calendar, args.calendar_dir))
+    else:
+        asyncio.run(main(profile_startup=args.profile_startup))
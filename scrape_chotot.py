@@ -1,10 +1,28 @@
 import os
+import sys
 import json
+import argparse
 import time
 import requests
 import gspread
+from gspread.utils import rowcol_to_a1
+import queue
 import random
 import re
+import sqlite3
+import hashlib
+import unicodedata
+import zlib
+import cProfile
+import tracemalloc
+from array import array
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from oauth2client.service_account import ServiceAccountCredentials
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
@@ -13,6 +31,10 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from datetime import datetime
 from bs4 import BeautifulSoup
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 
 # ────────────────────────────────────────────────
 # CẤU HÌNH
@@ -23,27 +45,246 @@ SHEET_ID = "14tqKftTqlesnb0NqJZU-_f1EsWWywYqO36NiuDdmaTo"
 SHEET_NAME = "Chợ tốt"
 MAX_PAGES = 12
 MAX_CONSECUTIVE_EMPTY = 3
-SLEEP_BETWEEN_PAGES = 4.5
+# Crawl song song có giới hạn; khoảng cách giữa 2 request cùng host tự điều chỉnh
+CRAWL_CONCURRENCY = int(os.environ.get("CRAWL_CONCURRENCY", "3"))
+CRAWL_INITIAL_INTERVAL = 1.5
+CRAWL_MIN_INTERVAL = 0.5
+CRAWL_MAX_INTERVAL = 15.0
+SLOW_RESPONSE_SECONDS = 4.0
 USER_AGENTS = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0.0.0 Safari/537.36",
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:131.0) Gecko/20100101 Firefox/131.0",
     "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/129.0.0.0 Safari/537.36",
 ]
 
+# Telegram: giãn cách mỗi chat (group ~20 tin/phút), số lần thử lại khi lỗi mạng/5xx/429
+TELEGRAM_GROUP_INTERVAL = 3.0
+TELEGRAM_CHAT_INTERVAL = 1.0
+TELEGRAM_MAX_RETRIES = 4
+
 HEADERS = ["STT", "Title", "Price", "Link", "Time Posted", "Location", "Seller", "Views", "Hidden"]
 
+# "http": tải HTML server-render bằng requests, chỉ dùng Chrome khi parse lỗi
+# "selenium": luôn dùng Chrome như cũ
+FETCH_MODE = os.environ.get("CHOTOT_FETCH_MODE", "http")
+HTTP_TIMEOUT = 15
+
+# Selector dùng chung cho Selenium và parse HTML: field → (CSS selector, giá trị mặc định)
+ITEM_SELECTOR = "li.a14axl8t"
+FIELD_SELECTORS = {
+    "price": ("span.bfe6oav", "Thỏa thuận"),
+    "time": ("span.c1u6gyxh.tx5yyjc", "N/A"),
+    "location": ("span.c1u6gyxh:not(.tx5yyjc)", "Hà Nội"),
+    "seller": ("div.dteznpi span.brnpcl3", "Ẩn danh"),
+    "views": ("div.vglk6qt span", "0"),
+}
+NO_RESULTS_MARKERS = ["không có kết quả", "không tìm thấy", "0 tin đăng"]
+
+# Chrome (khi cần): số instance dùng lại, số trang tối đa mỗi instance trước khi khởi động lại
+DRIVER_POOL_SIZE = int(os.environ.get("DRIVER_POOL_SIZE", "1"))
+DRIVER_MAX_PAGES = 50
+# Chặn qua CDP: ảnh, media, font và tracker bên thứ ba (chỉ cần DOM danh sách tin)
+BLOCKED_URL_PATTERNS = [
+    "*.jpg", "*.jpeg", "*.png", "*.gif", "*.webp", "*.avif", "*.svg", "*.ico",
+    "*.mp4", "*.webm", "*.mp3", "*.m3u8",
+    "*.woff", "*.woff2", "*.ttf", "*.otf",
+    "*googletagmanager.com*", "*google-analytics.com*", "*doubleclick.net*",
+    "*googlesyndication.com*", "*googleadservices.com*", "*facebook.net*", "*facebook.com/tr*",
+    "*connect.facebook*", "*hotjar.com*", "*clarity.ms*", "*tiktok.com*", "*criteo*",
+]
+
+# Store SQLite cục bộ (cache giữa các lần chạy bằng actions/cache); sheet được ghi theo sau
+LISTINGS_DB = os.environ.get("LISTINGS_DB", ".cache/chotot_listings.db")
+# Nạp lại toàn bộ sheet vào store định kỳ để nhận các sửa tay (SHEET_RESYNC=1 để ép)
+SHEET_RESYNC_HOURS = float(os.environ.get("SHEET_RESYNC_HOURS", "24"))
+# Mỗi lần đồng bộ: mọi khoảng dòng đổi đi chung 1 values:batchUpdate, chỉ tách khi payload vượt ngưỡng
+# (Sheets khuyến nghị ≤ 2MB/request; quota ghi ~60 request/phút/user)
+SHEET_WRITE_MAX_BYTES = 2_000_000
+# Lưới sheet hết chỗ → thêm dư ít nhất chừng này dòng để các lần nối tin mới sau không phải add_rows
+SHEET_GROW_ROWS = 1000
+# Ghi sheet giữa chừng sau mỗi N trang (0 = chỉ ghi cuối lần chạy)
+SHEET_FLUSH_PAGES = int(os.environ.get("SHEET_FLUSH_PAGES", "4"))
+# Số tin mới tối đa chờ lấy ảnh/gửi Telegram trước khi vòng quét phải chờ
+PIPELINE_QUEUE_SIZE = 50
+# Nhật ký lần chạy cho --resume (cache cùng store)
+JOURNAL_PATH = os.environ.get("SCRAPE_JOURNAL", ".cache/scrape_journal.jsonl")
+
+# Nhiều search trong 1 lần chạy: file JSON dạng
+#   [{"name": "...", "url": "https://www.chotot.com/...", "sheet": "...",
+#     "chat_id": "..." hoặc "chat_env": "TÊN_BIẾN_ENV", "max_pages": 12}, ...]
+# Mỗi search có sheet, chat Telegram, store và nhật ký riêng; session, nhịp crawl và Chrome dùng chung.
+# Không có file → 1 search mặc định START_URL → SHEET_NAME, chat TELEGRAM_CHAT_ID
+SEARCHES_PATH = os.environ.get("CHOTOT_SEARCHES", "searches.json")
+DEFAULT_SEARCH_NAME = "Nhạc cụ Hà Nội ≤ 2.1tr"
+
+# "auto": quét tăng dần tới trang đầu tiên toàn tin cũ hơn watermark, quét đủ MAX_PAGES
+#         mỗi FULL_REFRESH_HOURS để cập nhật Views/Hidden; "full" / "incremental": ép 1 kiểu
+CRAWL_MODE = os.environ.get("CRAWL_MODE", "auto")
+FULL_REFRESH_HOURS = float(os.environ.get("FULL_REFRESH_HOURS", "6"))
+
+# Tin gần trùng (đăng lại, sửa vài chữ): MinHash 12 band × 4 hàng, Jaccard ước lượng ≥ ngưỡng
+NEAR_DUP_BANDS = 12
+NEAR_DUP_ROWS_PER_BAND = 4
+NEAR_DUP_THRESHOLD = float(os.environ.get("NEAR_DUP_THRESHOLD", "0.8"))
+NEAR_DUP_MAX_CANDIDATES = 50
+
+# Báo cáo JSON mỗi lần chạy (thời gian từng bước/trang, số lời gọi API, bộ nhớ)
+RUN_REPORT_PATH = os.environ.get("RUN_REPORT_PATH", ".cache/run_report.json")
+TRACEMALLOC_TOP = 10
+
+# --watch: poll trang 1 liên tục, khoảng cách tự điều chỉnh theo lượng tin mới từng giờ
+WATCH_MAX_HOURS = float(os.environ.get("WATCH_MAX_HOURS", "5.5"))
+WATCH_MIN_INTERVAL = 60
+WATCH_MAX_INTERVAL = 900
+WATCH_DEFAULT_INTERVAL = 180
+# Nhắm trung bình ~0.5 tin mới mỗi lần poll
+WATCH_TARGET_NEW_PER_POLL = 0.5
+WATCH_RATE_ALPHA = 0.3
+# Tin cũ đổi Views/STT chỉ đẩy lên sheet mỗi WATCH_SYNC_SECONDS; có tin mới thì đẩy sớm hơn,
+# nhưng cách lần đồng bộ trước ít nhất WATCH_SYNC_NEW_SECONDS (Tele đã báo ngay, sheet không cần tức thì)
+WATCH_SYNC_SECONDS = 600
+WATCH_SYNC_NEW_SECONDS = 300
+
 def log(message):
     now = datetime.now().strftime("%H:%M:%S")
     print(f"[{now}] {message}")
 
+class RunStats:
+    # Số đo của 1 lần chạy: thời gian từng bước / từng trang, số lời gọi ra ngoài
+    # (WebDriver, Sheets, Telegram, HTTP), bộ nhớ → ghi ra 1 file JSON cuối lần chạy
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self.stages = {}
+        self.pages = {}
+        self.counters = {}
+        self.memory = []
+        self.info = {}
+        # Search đang chạy trên thread hiện tại (xem search()) → số đo theo trang tách riêng từng search
+        self.local = threading.local()
+
+    @contextmanager
+    def search(self, name):
+        previous = getattr(self.local, "search", "")
+        self.local.search = name
+        try:
+            yield
+        finally:
+            self.local.search = previous
+
+    def _page_key(self, page):
+        return (getattr(self.local, "search", ""), page)
+
+    @contextmanager
+    def span(self, name, page=None):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started, page)
+
+    def record(self, name, elapsed, page=None):
+        with self.lock:
+            stage = self.stages.setdefault(name, {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+            stage["count"] += 1
+            stage["seconds"] += elapsed
+            stage["max_seconds"] = max(stage["max_seconds"], elapsed)
+            if page is not None:
+                timings = self.pages.setdefault(self._page_key(page), {})
+                timings[name] = timings.get(name, 0.0) + elapsed
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def page_info(self, page, **fields):
+        with self.lock:
+            self.pages.setdefault(self._page_key(page), {}).update(fields)
+
+    def snapshot_memory(self, label):
+        entry = {"label": label, "elapsed_seconds": round(time.monotonic() - self.started, 3),
+                 "peak_rss_mb": peak_rss_mb()}
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ])
+            entry["traced_current_mb"] = round(current / 2 ** 20, 2)
+            entry["traced_peak_mb"] = round(peak / 2 ** 20, 2)
+            entry["top"] = [
+                {"where": str(stat.traceback[0]), "size_kb": round(stat.size / 1024, 1), "count": stat.count}
+                for stat in snapshot.statistics("lineno")[:TRACEMALLOC_TOP]
+            ]
+        with self.lock:
+            self.memory.append(entry)
+
+    def report(self):
+        with self.lock:
+            return {
+                "started_at": self.started_at,
+                "duration_seconds": round(time.monotonic() - self.started, 3),
+                "info": dict(self.info),
+                "stages": {
+                    name: {"count": s["count"], "seconds": round(s["seconds"], 4),
+                           "max_seconds": round(s["max_seconds"], 4)}
+                    for name, s in sorted(self.stages.items())
+                },
+                "pages": {
+                    (f"{search}:{page}" if search else str(page)): {
+                        k: round(v, 4) if isinstance(v, float) else v for k, v in fields.items()
+                    }
+                    for (search, page), fields in sorted(self.pages.items())
+                },
+                "calls": dict(sorted(self.counters.items())),
+                "peak_rss_mb": peak_rss_mb(),
+                "memory": list(self.memory),
+            }
+
+    def write(self, path):
+        report = self.report()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(report, ensure_ascii=False, indent=2))
+        slowest = sorted(report["stages"].items(), key=lambda kv: kv[1]["seconds"], reverse=True)[:5]
+        log("Thời gian theo bước: " + ", ".join(f"{name} {s['seconds']:.2f}s" for name, s in slowest))
+        log(f"Đã ghi báo cáo lần chạy: {path}")
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux: KB, macOS: byte
+    return round(peak / (2 ** 20 if sys.platform == "darwin" else 1024), 1)
+
+RUN_STATS = RunStats()
+
 def get_telegram_config():
     return {
         "token": os.environ.get("TELEGRAM_BOT_TOKEN"),
         "chat_id": os.environ.get("TELEGRAM_CHAT_ID")
     }
 
+def get_http_session():
+    # 1 Session cho cả lần chạy: giữ kết nối keep-alive, retry lỗi mạng/5xx
+    session = requests.Session()
+    retry = Retry(total=2, backoff_factor=1, status_forcelist=[500, 502, 503, 504], allowed_methods=["GET"])
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({
+        "User-Agent": random.choice(USER_AGENTS),
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+        "Accept-Language": "vi-VN,vi;q=0.9,en;q=0.8",
+    })
+    return session
+
 def setup_driver():
     log("Khởi tạo Chrome headless...")
+    RUN_STATS.count("webdriver.start")
     options = Options()
     options.add_argument("--headless")
     options.add_argument("--no-sandbox")
@@ -51,10 +292,126 @@ def setup_driver():
     options.add_argument("--window-size=1920,1080")
     options.add_argument("--disable-blink-features=AutomationControlled")
     options.add_argument(f"user-agent={random.choice(USER_AGENTS)}")
-    driver = webdriver.Chrome(options=options)
+    options.add_argument("--blink-settings=imagesEnabled=false")
+    # Chỉ đọc DOM → không chờ ảnh/iframe tải xong
+    options.page_load_strategy = "eager"
+    with RUN_STATS.span("webdriver.start"):
+        driver = webdriver.Chrome(options=options)
+    try:
+        RUN_STATS.count("webdriver.execute_cdp_cmd", 2)
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS})
+    except Exception as e:
+        log(f"Không chặn được tài nguyên qua CDP: {e}")
     return driver
 
-def connect_google_sheet():
+def quit_driver(driver):
+    try:
+        driver.quit()
+    except Exception as e:
+        log(f"Lỗi đóng Chrome: {e}")
+
+class DriverPool:
+    # Tối đa `size` Chrome dùng lại giữa các trang; Chrome lỗi hoặc đã mở max_uses trang thì thay mới
+    def __init__(self, size=None, max_uses=None):
+        self.size = max(1, size or DRIVER_POOL_SIZE)
+        self.max_uses = max_uses or DRIVER_MAX_PAGES
+        self.idle = []
+        self.created = 0
+        self.closed = False
+        # id() các Chrome người mượn báo hỏng dù không có exception thoát ra (xem mark_unhealthy)
+        self.unhealthy = set()
+        self.cond = threading.Condition()
+
+    @contextmanager
+    def driver(self):
+        driver, uses = self._acquire()
+        healthy = False
+        try:
+            yield driver
+            healthy = True
+        finally:
+            with self.cond:
+                if id(driver) in self.unhealthy:
+                    self.unhealthy.discard(id(driver))
+                    healthy = False
+            self._release(driver, uses + 1, healthy)
+
+    def mark_unhealthy(self, driver):
+        # fetch_listing_page_selenium nuốt lỗi và trả "failed" → người mượn báo để Chrome bị thay khi trả
+        with self.cond:
+            self.unhealthy.add(id(driver))
+
+    def _acquire(self):
+        with self.cond:
+            while not self.idle and self.created >= self.size:
+                self.cond.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.created += 1
+        try:
+            return setup_driver(), 0
+        except Exception:
+            with self.cond:
+                self.created -= 1
+                self.cond.notify()
+            raise
+
+    def _release(self, driver, uses, healthy):
+        with self.cond:
+            if healthy and uses < self.max_uses and not self.closed:
+                self.idle.append((driver, uses))
+                self.cond.notify()
+                return
+        quit_driver(driver)
+        with self.cond:
+            self.created -= 1
+            self.cond.notify()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.created -= len(idle)
+        for driver, _ in idle:
+            quit_driver(driver)
+
+def _search_path(path, slug):
+    # .cache/chotot_listings.db → .cache/chotot_listings-<slug>.db
+    root, ext = os.path.splitext(path)
+    return f"{root}-{slug}{ext}"
+
+def load_searches(path=None):
+    path = path or SEARCHES_PATH
+    try:
+        with open(path, encoding="utf-8") as f:
+            entries = json.load(f)
+    except FileNotFoundError:
+        entries = [{"name": DEFAULT_SEARCH_NAME, "url": START_URL, "sheet": SHEET_NAME}]
+    searches, slugs, sheets = [], set(), set()
+    for entry in entries:
+        name = entry.get("name") or entry["sheet"]
+        sheet = entry.get("sheet") or name
+        slug = normalize_text(name).replace(" ", "-")
+        # 2 search cùng 1 sheet / cùng store sẽ ghi đè bản chiếu của nhau
+        if slug in slugs or sheet in sheets:
+            raise ValueError(f"Search trùng tên hoặc trùng sheet: {name} → {sheet}")
+        slugs.add(slug)
+        sheets.add(sheet)
+        # Search ghi vào sheet mặc định dùng lại store/nhật ký đã cache từ trước
+        default = sheet == SHEET_NAME
+        searches.append({
+            "name": name,
+            "url": entry["url"],
+            "sheet": sheet,
+            "chat_id": entry.get("chat_id") or os.environ.get(entry.get("chat_env") or "TELEGRAM_CHAT_ID"),
+            "max_pages": int(entry.get("max_pages", MAX_PAGES)),
+            "db": LISTINGS_DB if default else _search_path(LISTINGS_DB, slug),
+            "journal": JOURNAL_PATH if default else _search_path(JOURNAL_PATH, slug),
+        })
+    return searches
+
+def open_spreadsheet():
     log("Kết nối Google Sheets...")
     scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
     creds_json_str = os.environ.get("GOOGLE_CREDENTIALS")
@@ -62,18 +419,25 @@ def connect_google_sheet():
         raise ValueError("Không tìm thấy GOOGLE_CREDENTIALS")
     
     creds = ServiceAccountCredentials.from_json_keyfile_dict(json.loads(creds_json_str), scope)
-    client = gspread.authorize(creds)
-    sh = client.open_by_key(SHEET_ID)
-    
+    # 429 (quota ghi/đọc) → gspread tự chờ lùi dần rồi thử lại
+    client = gspread.authorize(creds, http_client=gspread.BackOffHTTPClient)
+    RUN_STATS.count("sheets.open_by_key")
+    return client.open_by_key(SHEET_ID)
+
+def connect_google_sheet(sheet_name=SHEET_NAME, spreadsheet=None):
+    # Nhiều search: mở spreadsheet 1 lần rồi lấy từng worksheet
+    sh = spreadsheet or open_spreadsheet()
     try:
-        worksheet = sh.worksheet(SHEET_NAME)
-        log(f"Tìm thấy sheet: {SHEET_NAME}")
+        RUN_STATS.count("sheets.worksheet")
+        worksheet = sh.worksheet(sheet_name)
+        log(f"Tìm thấy sheet: {sheet_name}")
     except gspread.WorksheetNotFound:
-        worksheet = sh.add_worksheet(title=SHEET_NAME, rows=2000, cols=10)
+        worksheet = sh.add_worksheet(title=sheet_name, rows=2000, cols=10)
         worksheet.append_row(HEADERS)
         log("Tạo sheet & header mới")
     
     # Đảm bảo header đúng và đủ cột
+    RUN_STATS.count("sheets.row_values")
     current_headers = worksheet.row_values(1)
     if current_headers != HEADERS:
         worksheet.update("A1:I1", [HEADERS])
@@ -82,50 +446,68 @@ def connect_google_sheet():
         worksheet.resize(cols=len(HEADERS))
     return worksheet
 
-def get_images_from_detail(link):
-    headers = {"User-Agent": random.choice(USER_AGENTS)}
-    try:
-        resp = requests.get(link, headers=headers, timeout=12)
-        if resp.status_code != 200:
-            log(f"Detail {link} status {resp.status_code}")
-            return []
-        
-        soup = BeautifulSoup(resp.text, "html.parser")
-        images = set()
+# Quét HTML chi tiết bằng regex biên dịch sẵn thay vì dựng cả cây DOM
+_SCRIPT_RE = re.compile(r'<script\b([^>]*)>(.*?)</script>', re.S | re.I)
+_LD_JSON_ATTR_RE = re.compile(r'type\s*=\s*["\']application/ld\+json["\']', re.I)
+_CDN_IMAGE_RE = re.compile(r'(https?://cdn.chotot.com/[^"\'\s]+?.(?:jpg|jpeg|png|webp))')
+_REAL_IMAGE_RE = re.compile(r'-\d{15,}.(jpg|jpeg|png|webp)$')
+DETAIL_CONCURRENCY = 6
+MAX_IMAGES = 6
+
+def extract_images_from_html(html):
+    images = set()
+    for attrs, body in _SCRIPT_RE.findall(html):
         # JSON-LD
-        for tag in soup.find_all("script", type="application/ld+json"):
+        if _LD_JSON_ATTR_RE.search(attrs):
             try:
-                data = json.loads(tag.string or "{}")
+                data = json.loads(body or "{}")
                 if isinstance(data, dict) and "image" in data:
                     img_val = data["image"]
                     if isinstance(img_val, str) and "cdn.chotot.com" in img_val:
                         images.add(img_val)
                     elif isinstance(img_val, list):
                         images.update([i for i in img_val if isinstance(i, str) and "cdn.chotot.com" in i])
-            except:
+            except ValueError:
                 pass
         # Regex trong script
-        for script in soup.find_all("script"):
-            text = script.string or ""
-            if "cdn.chotot.com" in text:
-                matches = re.findall(r'(https?://cdn.chotot.com/[^"\'\s]+?.(?:jpg|jpeg|png|webp))', text)
-                for m in matches:
-                    if re.search(r'-\d{15,}.(jpg|jpeg|png|webp)$', m):
-                        images.add(m)
-        real_images = sorted(list(images))[:6]
+        if "cdn.chotot.com" in body:
+            for m in _CDN_IMAGE_RE.findall(body):
+                if _REAL_IMAGE_RE.search(m):
+                    images.add(m)
+    return sorted(images)[:MAX_IMAGES]
+
+def get_images_from_detail(link, session=None):
+    RUN_STATS.count("http.detail")
+    try:
+        with RUN_STATS.span("detail.fetch"):
+            if session is not None:
+                resp = session.get(link, timeout=12)
+            else:
+                resp = requests.get(link, headers={"User-Agent": random.choice(USER_AGENTS)}, timeout=12)
+        if resp.status_code != 200:
+            log(f"Detail {link} status {resp.status_code}")
+            return []
+        real_images = extract_images_from_html(resp.text)
         log(f"Lấy {len(real_images)} ảnh từ detail {link}")
         return real_images
     except Exception as e:
         log(f"Lỗi lấy ảnh {link}: {e}")
         return []
 
-def send_telegram_with_media(item, images):
-    cfg = get_telegram_config()
-    if not cfg["token"] or not cfg["chat_id"]:
-        return
-    
-    caption = (
+def fetch_images_concurrently(links, session, max_workers=DETAIL_CONCURRENCY):
+    # link → [ảnh]; các trang chi tiết tải song song qua cùng 1 Session keep-alive
+    if not links:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(links))) as pool:
+        results = pool.map(lambda link: get_images_from_detail(link, session), links)
+        return dict(zip(links, results))
+
+def format_alert(item):
+    # Chạy nhiều search → ghi tên search để biết tin đến từ đâu
+    search = f"🔎 {item['search']}\n" if item.get("search") else ""
+    return (
         f"🎸 <b>HÀNG MỚI - CHỢ TỐT</b>\n\n"
+        f"{search}"
         f"<b>{item['title']}</b>\n"
         f"💰 <b>{item['price']}</b>\n"
         f"👤 {item['seller']}\n"
@@ -134,260 +516,1315 @@ def send_telegram_with_media(item, images):
         f"⏰ {item['time']}\n\n"
         f"<a href='{item['link']}'>🔗 Xem chi tiết</a>"
     )
-    media_group = []
-    for idx, img_url in enumerate(images):
-        media_group.append({
-            "type": "photo",
-            "media": img_url,
-            "caption": caption if idx == 0 else "",
-            "parse_mode": "HTML"
-        })
-    if media_group:
-        url = f"https://api.telegram.org/bot{cfg['token']}/sendMediaGroup"
-        payload = {"chat_id": cfg["chat_id"], "media": json.dumps(media_group)}
-        try:
-            requests.post(url, data=payload, timeout=20)
-            log(f"Đã gửi album {len(images)} ảnh cho tin mới: {item['title']}")
-        except Exception as e:
-            log(f"Lỗi gửi media group: {e}")
-    else:
-        send_telegram_alert(item)
 
-def send_telegram_alert(item):
+class TelegramSender:
+    # Hàng đợi gửi Telegram trên 1 thread nền: vòng quét chỉ put() rồi đi tiếp.
+    # 1 Session giữ kết nối, giãn cách theo từng chat, 429 → chờ đúng retry_after rồi gửi lại,
+    # album lỗi → gửi lại dạng text. Mỗi tin có thể đi 1 chat khác nhau (mặc định chat_id)
+    def __init__(self, token, chat_id=None):
+        self.token = token
+        self.chat_id = chat_id
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self.queue = queue.Queue()
+        self.next_send = {}
+        self.thread = threading.Thread(target=self._run, name="telegram-sender", daemon=True)
+        self.thread.start()
+
+    def submit(self, item, images=None, on_sent=None, chat_id=None):
+        # on_sent(item): gọi trên thread gửi sau khi Telegram nhận tin
+        self.queue.put((item, list(images or []), on_sent, chat_id or self.chat_id))
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                item, images, on_sent, chat_id = job
+                if self._deliver(item, images, chat_id) and on_sent is not None:
+                    on_sent(item)
+            except Exception as e:
+                log(f"Lỗi gửi Telegram: {e}")
+            finally:
+                self.queue.task_done()
+
+    def _deliver(self, item, images, chat_id):
+        if not chat_id:
+            log(f"Không có chat Telegram cho tin: {item['title']}")
+            return False
+        caption = format_alert(item)
+        if images:
+            media_group = [
+                {"type": "photo", "media": url, "caption": caption if idx == 0 else "", "parse_mode": "HTML"}
+                for idx, url in enumerate(images)
+            ]
+            if self._call("sendMediaGroup", {"chat_id": chat_id, "media": json.dumps(media_group)}):
+                log(f"Đã gửi album {len(images)} ảnh cho tin mới: {item['title']}")
+                return True
+            log(f"Gửi album lỗi → gửi dạng text: {item['title']}")
+        if self._call("sendMessage", {"chat_id": chat_id, "text": caption, "parse_mode": "HTML"}):
+            log(f"Đã gửi tin mới: {item['title']}")
+            return True
+        return False
+
+    def _pace(self, chat_id):
+        # Group: ~20 tin/phút, chat riêng: ~1 tin/giây
+        wait = self.next_send.get(chat_id, 0) - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        interval = TELEGRAM_GROUP_INTERVAL if str(chat_id).startswith("-") else TELEGRAM_CHAT_INTERVAL
+        self.next_send[chat_id] = time.monotonic() + interval
+
+    def _call(self, method, payload):
+        url = f"https://api.telegram.org/bot{self.token}/{method}"
+        for attempt in range(TELEGRAM_MAX_RETRIES):
+            with RUN_STATS.span("telegram.pace"):
+                self._pace(payload["chat_id"])
+            RUN_STATS.count(f"telegram.{method}")
+            try:
+                with RUN_STATS.span(f"telegram.{method}"):
+                    resp = self.session.post(url, data=payload, timeout=20)
+                body = resp.json()
+            except (requests.RequestException, ValueError) as e:
+                log(f"Telegram {method} lỗi mạng (lần {attempt + 1}): {e}")
+                time.sleep(2 ** attempt)
+                continue
+            if body.get("ok"):
+                return True
+            retry_after = (body.get("parameters") or {}).get("retry_after")
+            if retry_after:
+                RUN_STATS.count("telegram.retry_after")
+                log(f"Telegram {method} 429 → chờ {retry_after}s")
+                self.next_send[payload["chat_id"]] = time.monotonic() + retry_after
+                continue
+            if resp.status_code >= 500:
+                time.sleep(2 ** attempt)
+                continue
+            log(f"Telegram {method} lỗi {resp.status_code}: {body.get('description')}")
+            return False
+        return False
+
+    def close(self):
+        # Chờ gửi hết hàng đợi rồi dừng thread
+        self.queue.put(None)
+        self.thread.join()
+        self.session.close()
+
+_TELEGRAM_SENDER = None
+_TELEGRAM_SENDER_LOCK = threading.Lock()
+
+def get_telegram_sender():
+    global _TELEGRAM_SENDER
+    # Chat mặc định có thể trống khi mọi search tự khai báo chat
     cfg = get_telegram_config()
-    if not cfg["token"] or not cfg["chat_id"]:
-        return
-    
-    message = (
-        f"🎸 <b>HÀNG MỚI - CHỢ TỐT</b>\n\n"
-        f"<b>{item['title']}</b>\n"
-        f"💰 <b>{item['price']}</b>\n"
-        f"👤 {item['seller']}\n"
-        f"👀 {item['views']} views\n"
-        f"📍 {item['location']}\n"
-        f"⏰ {item['time']}\n\n"
-        f"<a href='{item['link']}'>🔗 Xem chi tiết</a>"
-    )
-    requests.post(
-        f"https://api.telegram.org/bot{cfg['token']}/sendMessage",
-        json={"chat_id": cfg["chat_id"], "text": message, "parse_mode": "HTML"},
-        timeout=10
-    )
+    if not cfg["token"]:
+        return None
+    with _TELEGRAM_SENDER_LOCK:
+        if _TELEGRAM_SENDER is None:
+            _TELEGRAM_SENDER = TelegramSender(cfg["token"], cfg["chat_id"])
+        return _TELEGRAM_SENDER
+
+def flush_telegram_sender():
+    # Chờ gửi xong mọi tin đã xếp hàng (kể cả lúc đang chờ 429), sender vẫn chạy tiếp cho search sau
+    with _TELEGRAM_SENDER_LOCK:
+        sender = _TELEGRAM_SENDER
+    if sender is not None:
+        pending = sender.queue.qsize()
+        if pending:
+            log(f"Chờ gửi nốt {pending} tin Telegram...")
+        sender.queue.join()
+
+def close_telegram_sender():
+    global _TELEGRAM_SENDER
+    with _TELEGRAM_SENDER_LOCK:
+        sender, _TELEGRAM_SENDER = _TELEGRAM_SENDER, None
+    if sender is not None:
+        pending = sender.queue.qsize()
+        if pending:
+            log(f"Chờ gửi nốt {pending} tin Telegram...")
+        sender.close()
+
+def send_telegram_with_media(item, images, on_sent=None, chat_id=None):
+    # Chỉ xếp hàng, không chờ Telegram
+    sender = get_telegram_sender()
+    if sender is not None:
+        sender.submit(item, images, on_sent, chat_id)
+
+def send_telegram_alert(item):
+    send_telegram_with_media(item, [])
 
 def page_has_no_results(driver):
+    RUN_STATS.count("webdriver.find_element")
     try:
         text = driver.find_element(By.TAG_NAME, "body").text.lower()
-        return any(x in text for x in ["không có kết quả", "không tìm thấy", "0 tin đăng"])
+        return any(x in text for x in NO_RESULTS_MARKERS)
     except:
         return False
 
+def build_item(link, title, fields, page):
+    # Chuẩn hoá chung cho mọi cách lấy dữ liệu (Selenium / HTML)
+    if not link.startswith("http"):
+        link = BASE_URL + link.strip()
+    views_digits = ''.join(c for c in fields["views"] if c.isdigit())
+    return {
+        "title": title or "Không có tiêu đề",
+        "price": fields["price"],
+        "link": link,
+        "time": fields["time"],
+        "location": fields["location"],
+        "seller": fields["seller"],
+        "views": int(views_digits) if views_digits else 0,
+        "scraped_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "page": page
+    }
+
+def parse_item_html(card, page):
+    a = card.find("a", href=True)
+    if a is None:
+        return None
+    h3 = card.select_one("h3")
+    fields = {}
+    for name, (selector, default) in FIELD_SELECTORS.items():
+        el = card.select_one(selector)
+        fields[name] = el.get_text(" ", strip=True) if el else default
+    return build_item(a["href"], h3.get_text(" ", strip=True) if h3 else "", fields, page)
+
+def fetch_listing_page_http(session, url, page, limiter=None):
+    # Trả (status, items): "ok" | "no_results" | "failed" (→ fallback Selenium).
+    # limiter chỉ bị giãn khi host có vấn đề (lỗi mạng, status ≠ 200, phản hồi chậm), không phải khi parse lỗi
+    RUN_STATS.count("http.listing")
+    started = time.monotonic()
+    try:
+        with RUN_STATS.span("http.fetch", page):
+            resp = session.get(url, timeout=HTTP_TIMEOUT)
+    except Exception as e:
+        log(f"HTTP trang {page} lỗi: {e}")
+        if limiter is not None:
+            limiter.record(False, time.monotonic() - started)
+        return "failed", []
+    if limiter is not None:
+        limiter.record(resp.status_code == 200, time.monotonic() - started)
+    if resp.status_code != 200:
+        log(f"HTTP trang {page} status {resp.status_code}")
+        return "failed", []
+
+    with RUN_STATS.span("http.parse", page):
+        return parse_listing_html(resp.text, page)
+
+def parse_listing_html(html, page):
+    # HTML trang danh sách → (status, items)
+    soup = BeautifulSoup(html, "html.parser")
+    cards = soup.select(ITEM_SELECTOR)
+    if not cards:
+        for tag in soup(["script", "style", "noscript"]):
+            tag.decompose()
+        body = soup.body.get_text(" ", strip=True).lower() if soup.body else ""
+        if any(x in body for x in NO_RESULTS_MARKERS):
+            return "no_results", []
+        return "failed", []
+
+    items = [data for data in (parse_item_html(card, page) for card in cards) if data]
+    if not items:
+        return "failed", []
+    return "ok", items
+
+# 1 lần execute_script lấy mọi field của mọi card + kiểm tra "không có kết quả"
+# Selector không khớp → null (Python thay bằng giá trị mặc định), không ném exception
+EXTRACT_CARDS_JS = """
+const [itemSelector, fieldSelectors, markers] = arguments;
+const text = el => (el ? el.innerText.trim() : null);
+const body = document.body ? document.body.innerText.toLowerCase() : "";
+const cards = Array.from(document.querySelectorAll(itemSelector)).map(card => {
+    const a = card.querySelector("a");
+    const out = {href: a ? a.href : null, title: text(card.querySelector("h3"))};
+    for (const [name, selector] of Object.entries(fieldSelectors)) {
+        out[name] = text(card.querySelector(selector));
+    }
+    return out;
+});
+return {no_results: markers.some(m => body.includes(m)), cards: cards};
+"""
+
+def extract_page_items(driver, page):
+    # Trả (no_results, items) sau đúng 1 round trip WebDriver
+    selectors = {name: selector for name, (selector, _) in FIELD_SELECTORS.items()}
+    RUN_STATS.count("webdriver.execute_script")
+    result = driver.execute_script(EXTRACT_CARDS_JS, ITEM_SELECTOR, selectors, NO_RESULTS_MARKERS)
+    items = []
+    for card in result["cards"]:
+        if not card.get("href"):
+            continue
+        fields = {
+            name: card[name] if card.get(name) is not None else default
+            for name, (_, default) in FIELD_SELECTORS.items()
+        }
+        items.append(build_item(card["href"], card.get("title") or "", fields, page))
+    return result["no_results"], items
+
+def fetch_listing_page_selenium(driver, url, page):
+    try:
+        RUN_STATS.count("webdriver.get")
+        with RUN_STATS.span("selenium.load", page):
+            driver.get(url)
+            WebDriverWait(driver, 15).until(EC.presence_of_element_located((By.CSS_SELECTOR, ITEM_SELECTOR)))
+    except Exception as e:
+        log(f"Load trang {page} lỗi: {e}")
+        return ("no_results" if page_has_no_results(driver) else "failed"), []
+
+    try:
+        with RUN_STATS.span("selenium.extract", page):
+            no_results, items = extract_page_items(driver, page)
+    except Exception as e:
+        # Script lỗi → quay về cách cũ: find_element từng field
+        log(f"Bulk extract trang {page} lỗi, dùng find_element: {e}")
+        if page_has_no_results(driver):
+            return "no_results", []
+        items = []
+        with RUN_STATS.span("selenium.extract_item_data", page):
+            RUN_STATS.count("webdriver.find_elements")
+            for item_el in driver.find_elements(By.CSS_SELECTOR, ITEM_SELECTOR):
+                data = extract_item_data(item_el, page)
+                if data:
+                    items.append(data)
+        return "ok", items
+
+    if no_results:
+        return "no_results", []
+    return "ok", items
+
 def extract_item_data(item_element, page):
+    # a, h3 + từng field: mỗi find_element là 1 round trip WebDriver
+    RUN_STATS.count("webdriver.find_element", 2 + len(FIELD_SELECTORS))
     try:
         a = item_element.find_element(By.TAG_NAME, "a")
         link = a.get_attribute("href")
-        if not link.startswith("http"):
-            link = BASE_URL + link.strip()
-        title = item_element.find_element(By.CSS_SELECTOR, "h3").text.strip() or "Không có tiêu đề"
-        
-        price = "Thỏa thuận"
+        title = item_element.find_element(By.CSS_SELECTOR, "h3").text.strip()
+        fields = {}
+        for name, (selector, default) in FIELD_SELECTORS.items():
+            try:
+                fields[name] = item_element.find_element(By.CSS_SELECTOR, selector).text.strip()
+            except:
+                fields[name] = default
+        return build_item(link, title, fields, page)
+    except:
+        return None
+
+class AdaptiveRateLimiter:
+    # Khoảng cách tối thiểu giữa 2 request tới 1 host:
+    # phản hồi tốt → giảm dần (x0.8), lỗi hoặc chậm → tăng gấp đôi
+    def __init__(self, interval=CRAWL_INITIAL_INTERVAL, min_interval=CRAWL_MIN_INTERVAL,
+                 max_interval=CRAWL_MAX_INTERVAL):
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def record(self, ok, elapsed):
+        with self.lock:
+            if ok and elapsed < SLOW_RESPONSE_SECONDS:
+                self.interval = max(self.min_interval, self.interval * 0.8)
+            else:
+                self.interval = min(self.max_interval, self.interval * 2)
+                log(f"Giãn nhịp crawl: {self.interval:.1f}s/request")
+
+_RATE_LIMITERS = {}
+_RATE_LIMITERS_LOCK = threading.Lock()
+
+def get_rate_limiter(url):
+    host = urlparse(url).netloc
+    with _RATE_LIMITERS_LOCK:
+        if host not in _RATE_LIMITERS:
+            _RATE_LIMITERS[host] = AdaptiveRateLimiter()
+        return _RATE_LIMITERS[host]
+
+def page_url(page, start_url=START_URL):
+    if page == 1:
+        return start_url
+    return f"{start_url}{'&' if '?' in start_url else '?'}page={page}"
+
+class PageFetcher:
+    # HTTP trước, Selenium khi cần; Chrome chỉ khởi động lần đầu phải fallback
+    def __init__(self, drivers=None):
+        self.session = get_http_session()
+        self.owns_drivers = drivers is None
+        self.drivers = drivers or DriverPool()
+
+    def fetch(self, page, stop=None, start_url=START_URL):
+        url = page_url(page, start_url)
+        limiter = get_rate_limiter(url)
+        with RUN_STATS.span("rate_limit.wait", page):
+            limiter.wait()
+        if stop is not None and stop.is_set():
+            return "cancelled", []
+        log(f"Trang {page} → {url}")
+
+        status, items, via = "failed", [], "http"
+        if FETCH_MODE == "http":
+            status, items = fetch_listing_page_http(self.session, url, page, limiter)
+            if status == "failed":
+                log(f"Trang {page}: không đọc được HTML → thử lại bằng Selenium")
+        if status == "failed":
+            # WebDriver không thread-safe → mỗi trang mượn riêng 1 Chrome trong pool
+            via = "selenium"
+            with self.drivers.driver() as driver:
+                started = time.monotonic()
+                status, items = fetch_listing_page_selenium(driver, url, page)
+                if status == "failed":
+                    # Chrome treo/crash cũng chỉ ra "failed" → không trả nó lại pool cho trang sau
+                    self.drivers.mark_unhealthy(driver)
+                # Không có status HTTP: chỉ giãn nhịp khi trang tải chậm (timeout chờ selector cũng tính là chậm)
+                limiter.record(True, time.monotonic() - started)
+        RUN_STATS.page_info(page, via=via, status=status, items=len(items))
+        return status, items
+
+    def close(self):
+        if self.owns_drivers:
+            self.drivers.close()
+        self.session.close()
+
+def crawl_pages(fetch_page, max_pages=MAX_PAGES, concurrency=CRAWL_CONCURRENCY, first_page=1):
+    # Tải trước tối đa `concurrency` trang, trả kết quả đúng thứ tự trang.
+    # Dừng sớm: consumer gọi .close() → huỷ các trang chưa chạy
+    stop = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=max(1, concurrency))
+    futures = {}
+    next_page = first_page
+    try:
+        for page in range(first_page, max_pages + 1):
+            while next_page <= max_pages and next_page < page + max(1, concurrency):
+                futures[next_page] = pool.submit(fetch_page, next_page, stop)
+                next_page += 1
+            status, items = futures.pop(page).result()
+            yield page, status, items
+    finally:
+        stop.set()
+        pool.shutdown(wait=True, cancel_futures=True)
+
+# STT, Views, Hidden ghi lên sheet dạng số (không phải chuỗi) để sort trên server theo giá trị số
+SHEET_NUMERIC_COLUMNS = (0, 7, 8)
+
+def _sheet_cell(value):
+    return int(value) if value.isdigit() else value
+
+def sheet_row_values(values, width):
+    row = values + [""] * (width - len(values))
+    for i in SHEET_NUMERIC_COLUMNS:
+        row[i] = _sheet_cell(row[i])
+    return row
+
+def _sort_value(value):
+    # Cùng thứ tự với sort tăng dần của Google Sheets: số < chữ < ô trống
+    if value.isdigit():
+        return (0, int(value), "")
+    if value:
+        return (1, 0, value.lower())
+    return (2, 0, "")
+
+def sheet_sort_key(row):
+    # Hidden (trang) ↑ rồi STT ↑; "Hidden" (chữ) xuống sau các trang.
+    # Link (duy nhất trong store) phá hoà: vị trí sau sortRange không phụ thuộc sort có ổn định hay không
+    hidden = row[8] if len(row) > 8 else ""
+    stt = row[0] if row else ""
+    link = row[3] if len(row) > 3 else ""
+    return (_sort_value(hidden), _sort_value(stt), _sort_value(link))
+
+def _row_ranges(indexes):
+    # [0, 1, 2, 7] → [(0, 2), (7, 7)]
+    ranges = []
+    for i in indexes:
+        if ranges and ranges[-1][1] == i - 1:
+            ranges[-1] = (ranges[-1][0], i)
+        else:
+            ranges.append((i, i))
+    return ranges
+
+# ────────────────────────────────────────────────
+# Phát hiện tin đăng lại (gần trùng): MinHash/LSH trên title + seller + price
+# ────────────────────────────────────────────────
+_NON_ALNUM_RE = re.compile(r'[^0-9a-z]+')
+_MINHASH_PRIME = (1 << 61) - 1
+_MINHASH_RNG = random.Random(20240611)
+_MINHASH_PARAMS = [
+    (_MINHASH_RNG.randrange(1, _MINHASH_PRIME), _MINHASH_RNG.randrange(0, _MINHASH_PRIME))
+    for _ in range(NEAR_DUP_BANDS * NEAR_DUP_ROWS_PER_BAND)
+]
+
+def normalize_text(text):
+    # "Đàn Guitar  Yamaha-F310!" → "dan guitar yamaha f310"
+    text = unicodedata.normalize("NFD", (text or "").lower().replace("đ", "d"))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(_NON_ALNUM_RE.sub(" ", text).split())
+
+def listing_features(title, seller, price):
+    # 3-gram ký tự của title (chịu được sửa vài chữ) + seller + giá dạng số
+    padded = f" {normalize_text(title)} "
+    features = {padded[i:i + 3] for i in range(max(1, len(padded) - 2))}
+    features.add("seller:" + normalize_text(seller))
+    features.add("price:" + re.sub(r"\D", "", price or ""))
+    return features
+
+@lru_cache(maxsize=65536)
+def _feature_hashes(feature):
+    # 3-gram lặp lại rất nhiều giữa các tin → cache giá trị băm của từng feature
+    h = zlib.crc32(feature.encode("utf-8"))
+    return tuple((a * h + b) % _MINHASH_PRIME for a, b in _MINHASH_PARAMS)
+
+def minhash_signature(features):
+    return list(map(min, zip(*(_feature_hashes(f) for f in features))))
+
+def lsh_buckets(signature):
+    # Mỗi band (NEAR_DUP_ROWS_PER_BAND giá trị liên tiếp, kèm số band) → 1 bucket int64
+    rows = NEAR_DUP_ROWS_PER_BAND
+    packed = array("Q", signature).tobytes()
+    width = rows * array("Q").itemsize
+    return [
+        int.from_bytes(
+            hashlib.blake2b(packed[band * width:(band + 1) * width], digest_size=8, salt=bytes([band])).digest(),
+            "big", signed=True
+        )
+        for band in range(NEAR_DUP_BANDS)
+    ]
+
+def signature_similarity(a, b):
+    # Ước lượng Jaccard của 2 tập feature
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+# ────────────────────────────────────────────────
+# Store SQLite: nguồn dữ liệu chính, sheet chỉ là bản chiếu
+# ────────────────────────────────────────────────
+_AD_ID_RE = re.compile(r'/(\d+)\.htm')
+
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS listings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    link TEXT UNIQUE,
+    ad_id INTEGER,
+    stt TEXT NOT NULL DEFAULT '',
+    title TEXT NOT NULL DEFAULT '',
+    price TEXT NOT NULL DEFAULT '',
+    time_posted TEXT NOT NULL DEFAULT '',
+    location TEXT NOT NULL DEFAULT '',
+    seller TEXT NOT NULL DEFAULT '',
+    views TEXT NOT NULL DEFAULT '',
+    hidden TEXT NOT NULL DEFAULT '',
+    extra TEXT NOT NULL DEFAULT '[]',
+    first_seen TEXT,
+    last_seen TEXT,
+    sheet_row INTEGER,
+    sheet_values TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_listings_ad_id ON listings(ad_id);
+CREATE INDEX IF NOT EXISTS idx_listings_title ON listings(title);
+CREATE TABLE IF NOT EXISTS views_history (
+    listing_id INTEGER NOT NULL,
+    seen_at TEXT NOT NULL,
+    views TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_views_history_listing ON views_history(listing_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS near_dup_signatures (
+    listing_id INTEGER PRIMARY KEY,
+    signature BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS near_dup_buckets (
+    bucket INTEGER NOT NULL,
+    listing_id INTEGER NOT NULL,
+    PRIMARY KEY (bucket, listing_id)
+) WITHOUT ROWID;
+"""
+
+# Thứ tự cột trong store khớp HEADERS của sheet
+STORE_COLUMNS = ["stt", "title", "price", "link", "time_posted", "location", "seller", "views", "hidden"]
+
+def extract_ad_id(link):
+    match = _AD_ID_RE.search(link or "")
+    return int(match.group(1)) if match else None
+
+class ListingStore:
+    def __init__(self, path=None):
+        path = path or LISTINGS_DB
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # WAL + busy timeout: thread ghi sheet mở connection riêng, đọc song song với vòng quét
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(STORE_SCHEMA)
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else default
+
+    def set_meta(self, key, value):
+        self.conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, str(value))
+        )
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM listings").fetchone()[0]
+
+    def count_titles(self):
+        return self.conn.execute("SELECT COUNT(DISTINCT title) FROM listings WHERE title != ''").fetchone()[0]
+
+    def needs_bootstrap(self, sheet_id):
+        # Nạp lại từ sheet khi: store trống, đổi sheet, ép bằng env, hoặc quá SHEET_RESYNC_HOURS
+        # (để nhận các sửa tay trên sheet)
+        if os.environ.get("SHEET_RESYNC") == "1":
+            return True
+        if self.get_meta("sheet_id") != sheet_id or self.count() == 0:
+            return True
+        synced_at = self.get_meta("sheet_synced_at")
+        if not synced_at:
+            return True
+        age = datetime.now() - datetime.fromisoformat(synced_at)
+        return age.total_seconds() > SHEET_RESYNC_HOURS * 3600
+
+    def import_sheet(self, rows, sheet_id):
+        # rows: dữ liệu sheet không có header, dòng i nằm ở sheet_row i + 2.
+        # Lịch sử views giữ nguyên theo link
+        now = datetime.now().isoformat(timespec="seconds")
+        old_ids = {
+            r["link"]: r["id"]
+            for r in self.conn.execute("SELECT id, link FROM listings WHERE link IS NOT NULL")
+        }
+        if self.get_meta("sheet_id") != sheet_id:
+            # Sheet khác → chưa biết STT/Hidden trên đó là số hay chữ
+            self.conn.execute("DELETE FROM meta WHERE key = 'sheet_numeric'")
+        self.conn.execute("DELETE FROM listings")
+        for i, row in enumerate(rows):
+            row = row + [""] * (len(STORE_COLUMNS) - len(row))
+            values = row[:len(STORE_COLUMNS)]
+            values[1] = values[1].strip()
+            values[3] = values[3].strip()
+            link = values[3] or None
+            self.conn.execute(
+                "INSERT OR IGNORE INTO listings (id, link, ad_id, stt, title, price, time_posted, location, "
+                "seller, views, hidden, extra, first_seen, last_seen, sheet_row, sheet_values) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [old_ids.get(link), link, extract_ad_id(link)] + values[:3] + values[4:]
+                + [json.dumps(row[len(STORE_COLUMNS):], ensure_ascii=False), now, now,
+                   i + 2, json.dumps(row, ensure_ascii=False)]
+            )
+        self.set_meta("sheet_id", sheet_id)
+        self.set_meta("sheet_rows", len(rows))
+        self.set_meta("sheet_synced_at", now)
+        indexed = self.index_missing_near_duplicates()
+        if indexed:
+            log(f"Đánh chỉ mục gần trùng cho {indexed} tin")
+        self.conn.commit()
+
+    def find(self, link):
+        return self.conn.execute("SELECT id, views FROM listings WHERE link = ?", (link,)).fetchone()
+
+    def has_ad(self, link):
+        # Cùng tin dù link khác (slug/category đổi) → so theo ad id
+        ad_id = extract_ad_id(link)
+        if ad_id is None:
+            return self.find(link) is not None
+        return self.conn.execute("SELECT 1 FROM listings WHERE ad_id = ? LIMIT 1", (ad_id,)).fetchone() is not None
+
+    def has_title(self, title):
+        return self.conn.execute("SELECT 1 FROM listings WHERE title = ? LIMIT 1", (title,)).fetchone() is not None
+
+    def _record_views(self, listing_id, views, seen_at):
+        self.conn.execute(
+            "INSERT INTO views_history (listing_id, seen_at, views) VALUES (?, ?, ?)",
+            (listing_id, seen_at, views)
+        )
+
+    def update_seen(self, listing, stt, views, hidden, seen_at):
+        self.conn.execute(
+            "UPDATE listings SET stt = ?, views = ?, hidden = ?, last_seen = ? WHERE id = ?",
+            (str(stt), str(views), str(hidden), seen_at, listing["id"])
+        )
+        if listing["views"] != str(views):
+            self._record_views(listing["id"], str(views), seen_at)
+
+    def insert(self, data, stt, hidden, seen_at):
+        cursor = self.conn.execute(
+            "INSERT INTO listings (link, ad_id, stt, title, price, time_posted, location, seller, views, "
+            "hidden, first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (data["link"], extract_ad_id(data["link"]), str(stt), data["title"], data["price"], data["time"],
+             data["location"], data["seller"], str(data["views"]), str(hidden), seen_at, seen_at)
+        )
+        self._record_views(cursor.lastrowid, str(data["views"]), seen_at)
+        self.index_near_duplicate(cursor.lastrowid, data["title"], data["seller"], data["price"])
+
+    def index_near_duplicate(self, listing_id, title, seller, price):
+        self._index_near_duplicates([(listing_id, title, seller, price)])
+
+    def _index_near_duplicates(self, listings):
+        signatures, buckets = [], []
+        for listing_id, title, seller, price in listings:
+            signature = minhash_signature(listing_features(title, seller, price))
+            signatures.append((listing_id, array("Q", signature).tobytes()))
+            buckets.extend((bucket, listing_id) for bucket in lsh_buckets(signature))
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO near_dup_signatures (listing_id, signature) VALUES (?, ?)", signatures
+        )
+        self.conn.executemany("INSERT OR IGNORE INTO near_dup_buckets (bucket, listing_id) VALUES (?, ?)", buckets)
+
+    def index_missing_near_duplicates(self):
+        # Sau khi nạp lại sheet: bỏ chỉ mục của tin không còn, thêm cho tin chưa có
+        self.conn.execute("DELETE FROM near_dup_signatures WHERE listing_id NOT IN (SELECT id FROM listings)")
+        self.conn.execute("DELETE FROM near_dup_buckets WHERE listing_id NOT IN (SELECT id FROM listings)")
+        missing = self.conn.execute(
+            "SELECT id, title, seller, price FROM listings "
+            "WHERE id NOT IN (SELECT listing_id FROM near_dup_signatures)"
+        ).fetchall()
+        self._index_near_duplicates([tuple(r) for r in missing])
+        return len(missing)
+
+    def find_near_duplicate(self, title, seller, price):
+        # Vài lookup theo khoá bucket rồi so chữ ký ứng viên → gần như O(1) theo số tin
+        signature = minhash_signature(listing_features(title, seller, price))
+        candidates = set()
+        for bucket in lsh_buckets(signature):
+            candidates.update(
+                r[0] for r in self.conn.execute(
+                    "SELECT listing_id FROM near_dup_buckets WHERE bucket = ? LIMIT ?",
+                    (bucket, NEAR_DUP_MAX_CANDIDATES)
+                )
+            )
+        best = None
+        for listing_id in candidates:
+            r = self.conn.execute(
+                "SELECT s.signature, l.link, l.title FROM near_dup_signatures s "
+                "JOIN listings l ON l.id = s.listing_id WHERE s.listing_id = ?",
+                (listing_id,)
+            ).fetchone()
+            if r is None:
+                continue
+            similarity = signature_similarity(signature, array("Q", r["signature"]))
+            if similarity >= NEAR_DUP_THRESHOLD and (best is None or similarity > best[2]):
+                best = (r["link"], r["title"], similarity)
+        return best
+
+    def projection(self):
+        # [(id, sheet_row, giá trị đã ghi lên sheet, giá trị hiện tại)]
+        records = []
+        for r in self.conn.execute("SELECT * FROM listings"):
+            values = [r[column] or "" for column in STORE_COLUMNS] + json.loads(r["extra"])
+            written = json.loads(r["sheet_values"]) if r["sheet_values"] else None
+            records.append((r["id"], r["sheet_row"], written, values))
+        return records
+
+    def mark_projected(self, assignments):
+        # assignments: [(id, sheet_row, values)] vừa ghi thành công lên sheet
+        self.conn.executemany(
+            "UPDATE listings SET sheet_row = ?, sheet_values = ? WHERE id = ?",
+            [(row_num, json.dumps(values, ensure_ascii=False), listing_id)
+             for listing_id, row_num, values in assignments]
+        )
+        self.conn.commit()
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+
+def choose_crawl_mode(store):
+    if CRAWL_MODE in ("full", "incremental"):
+        return CRAWL_MODE
+    last_full = store.get_meta("last_full_refresh")
+    if not last_full or store.get_meta("watermark_ad_id") is None:
+        return "full"
+    age = datetime.now() - datetime.fromisoformat(last_full)
+    return "full" if age.total_seconds() > FULL_REFRESH_HOURS * 3600 else "incremental"
+
+def page_is_known(store, items, watermark):
+    # Trang "cũ hoàn toàn": mọi tin có ad id ≤ watermark hoặc link đã có trong store
+    if not items:
+        return False
+    for data in items:
+        ad_id = extract_ad_id(data["link"])
+        if ad_id is not None and ad_id <= watermark:
+            continue
+        if store.find(data["link"]) is None:
+            return False
+    return True
+
+def _write_sheet_rows(worksheet, store, writes, width, max_bytes):
+    # writes: [(id, sheet_row, values)] → các khoảng dòng liền nhau, tất cả trong 1 batch_update;
+    # chỉ tách request khi payload vượt max_bytes
+    writes = sorted(writes, key=lambda w: w[1])
+    by_row = {row_num: (listing_id, values) for listing_id, row_num, values in writes}
+    batch, assignments, size = [], [], 0
+    for first, last in _row_ranges([w[1] for w in writes]):
+        for row_num in range(first, last + 1):
+            row = sheet_row_values(by_row[row_num][1], width)
+            row_bytes = len(json.dumps(row, ensure_ascii=False).encode("utf-8"))
+            if assignments and size + row_bytes > max_bytes:
+                _send_sheet_batch(worksheet, store, batch, assignments)
+                batch, assignments, size = [], [], 0
+            # Dòng liền dòng trước trong cùng request → nối vào khoảng đang mở
+            if assignments and assignments[-1][2] == row_num - 1:
+                batch[-1]["rows"].append(row)
+            else:
+                batch.append({"first": row_num, "rows": [row]})
+            assignments.append((*by_row[row_num], row_num))
+            size += row_bytes
+    if batch:
+        _send_sheet_batch(worksheet, store, batch, assignments)
+
+def _send_sheet_batch(worksheet, store, batch, assignments):
+    data = [
+        {"range": f"{rowcol_to_a1(b['first'], 1)}:{rowcol_to_a1(b['first'] + len(b['rows']) - 1, len(b['rows'][0]))}",
+         "values": b["rows"]}
+        for b in batch
+    ]
+    RUN_STATS.count("sheets.batch_update")
+    worksheet.batch_update(data)
+    # Dòng nối thêm đã nằm trên sheet → sheet_rows theo kịp dù batch sau lỗi
+    last_row = max(row_num for _, _, row_num in assignments)
+    if last_row - 1 > int(store.get_meta("sheet_rows", "0")):
+        store.set_meta("sheet_rows", last_row - 1)
+    store.mark_projected([(listing_id, row_num, values) for listing_id, values, row_num in assignments])
+
+def _ensure_sheet_rows(worksheet, rows):
+    # Dòng mới nằm ngoài lưới hiện tại → mở rộng sheet (dư SHEET_GROW_ROWS) trước khi ghi
+    if worksheet.row_count < rows:
+        RUN_STATS.count("sheets.add_rows")
+        worksheet.add_rows(max(rows - worksheet.row_count, SHEET_GROW_ROWS))
+
+def sync_sheet_projection(worksheet, store, max_bytes=SHEET_WRITE_MAX_BYTES):
+    # Sheet = các tin trong store, sort theo Hidden ↑ → STT ↑, không bao giờ clear sheet.
+    # Thường: dòng đổi nội dung ghi đè tại chỗ, tin mới nối vào cuối, rồi 1 sortRange trên server
+    # → số ô gửi lên tỉ lệ với số dòng đổi/mới, không theo kích thước sheet
+    records = store.projection()
+    width = max([len(HEADERS)] + [len(r[3]) for r in records])
+    sheet_rows = int(store.get_meta("sheet_rows", "0"))
+    placed = sorted(r[1] for r in records if r[1] is not None)
+
+    # Sheet cũ ghi STT/Hidden dạng chữ, hoặc có dòng không thuộc store (link trùng lúc nạp)
+    # → sắp xếp tại chỗ và ghi lại toàn bộ đúng thứ tự 1 lần
+    if (store.get_meta("sheet_numeric") != "1" or sheet_rows != len(placed)
+            or placed != list(range(2, len(placed) + 2))):
+        return _rewrite_sheet(worksheet, store, records, width, sheet_rows, max_bytes)
+
+    rows = {}
+    writes = []
+    next_row = len(placed) + 2
+    for listing_id, sheet_row, written, values in records:
+        if sheet_row is None:
+            sheet_row = next_row
+            next_row += 1
+            writes.append((listing_id, sheet_row, values))
+        elif written != values:
+            writes.append((listing_id, sheet_row, values))
+        rows[listing_id] = sheet_row
+    if not writes:
+        return 0
+
+    _ensure_sheet_rows(worksheet, next_row - 1)
+    _write_sheet_rows(worksheet, store, writes, width, max_bytes)
+
+    # Vị trí sau khi server sort: khoá Hidden, STT, Link là duy nhất → không có hoà cần đoán
+    records.sort(key=lambda r: (sheet_sort_key(r[3]), rows[r[0]]))
+    moved = [(r[0], pos + 2, r[3]) for pos, r in enumerate(records) if rows[r[0]] != pos + 2]
+    if moved:
+        RUN_STATS.count("sheets.sort")
         try:
-            price = item_element.find_element(By.CSS_SELECTOR, "span.bfe6oav").text.strip()
-        except:
-            pass
-        time_posted = "N/A"
+            worksheet.sort((9, "asc"), (1, "asc"), (4, "asc"), range=f"A2:{rowcol_to_a1(len(records) + 1, width)}")
+        except Exception:
+            # Không rõ server đã sort chưa → lần sau nạp lại sheet để lấy đúng vị trí từng dòng
+            store.set_meta("sheet_synced_at", "")
+            store.commit()
+            raise
+        store.mark_projected(moved)
+    return len(writes)
+
+def _rewrite_sheet(worksheet, store, records, width, sheet_rows, max_bytes):
+    records.sort(key=lambda r: (sheet_sort_key(r[3]), r[1] if r[1] is not None else float("inf"), r[0]))
+    # Dòng thừa cuối sheet (link trùng lúc nạp) → xoá nội dung phần đuôi đó
+    if sheet_rows > len(records):
+        RUN_STATS.count("sheets.batch_clear")
+        worksheet.batch_clear([f"{rowcol_to_a1(len(records) + 2, 1)}:{rowcol_to_a1(sheet_rows + 1, width)}"])
+    _ensure_sheet_rows(worksheet, len(records) + 1)
+    if records:
+        _write_sheet_rows(worksheet, store, [(r[0], pos + 2, r[3]) for pos, r in enumerate(records)],
+                          width, max_bytes)
+    # Ghi meta sau cùng: không giữ transaction ghi SQLite qua các lời gọi mạng (vòng quét sẽ bị "database is locked");
+    # lỗi giữa chừng thì sheet_rows cũ ≠ số dòng → lần sau ghi lại toàn bộ
+    store.set_meta("sheet_rows", len(records))
+    store.set_meta("sheet_numeric", "1")
+    store.commit()
+    return len(records)
+
+def open_store(worksheet, path=None):
+    store = ListingStore(path)
+    # Chỉ tải toàn bộ sheet khi store chưa có dữ liệu / cần đồng bộ lại
+    if store.needs_bootstrap(SHEET_ID):
         try:
-            time_posted = item_element.find_element(By.CSS_SELECTOR, "span.c1u6gyxh.tx5yyjc").text.strip()
-        except:
-            pass
-        location = "Hà Nội"
+            RUN_STATS.count("sheets.get_all_values")
+            all_values = worksheet.get_all_values()
+        except Exception:
+            # Không có dữ liệu cũ thì mọi tin đều thành "mới" và bản chiếu sẽ ghi đè sheet → dừng
+            store.close()
+            raise
+        store.import_sheet(all_values[1:] if len(all_values) > 1 else [], SHEET_ID)
+        log(f"Nạp {len(all_values) - 1 if all_values else 0} dòng từ sheet vào store")
+    log(f"Store: {store.count()} tin cũ | {store.count_titles()} title khác nhau")
+    return store
+
+def record_listing(store, data, stt, page, seen_at):
+    # ────────────────────────────────────────────────
+    # Chỉ check tin mới ở trang 1, chỉ "new" (gửi Telegram) nếu CẢ title VÀ link đều KHÔNG trùng
+    #   "updated": link đã có → update STT/Views/Hidden
+    #   "repost":  title trùng (hoặc gần trùng title/seller/giá) nhưng link mới
+    #              → vẫn thêm vào sheet, KHÔNG gửi Telegram
+    #   None:      trang >=2 và link chưa có → bỏ qua
+    # ────────────────────────────────────────────────
+    existing = store.find(data["link"])
+    if existing:
+        store.update_seen(existing, stt, data["views"], page, seen_at)
+        return "updated"
+    if page != 1:
+        return None
+    if store.has_title(data["title"]):
+        kind = "repost"
+    else:
+        match = store.find_near_duplicate(data["title"], data["seller"], data["price"])
+        if match:
+            log(f"Gần trùng ({match[2]:.0%}) với tin cũ: {match[1][:40]} | {match[0]}")
+        kind = "repost" if match else "new"
+    store.insert(data, stt, page, seen_at)
+    return kind
+
+def send_alerts(alerts, session, on_sent=None, chat_id=None):
+    # Lấy ảnh của tất cả tin cùng lúc rồi gửi Telegram theo thứ tự
+    images_by_link = fetch_images_concurrently([d["link"] for d in alerts], session)
+    for alert in alerts:
+        send_telegram_with_media(alert, images_by_link.get(alert["link"], []), on_sent, chat_id)
+
+class RunJournal:
+    # Nhật ký append-only (JSONL, fsync từng dòng) của lần chạy gần nhất: trang đã xử lý,
+    # tin mới đã xếp hàng / đã gửi Telegram, các lần ghi sheet. --resume đọc lại để làm nốt phần dở
+    def __init__(self, path=None):
+        self.path = path or JOURNAL_PATH
+        self.lock = threading.Lock()
+        self.file = None
+        self.run_id = None
+
+    def _events(self):
+        events = []
         try:
-            location = item_element.find_element(By.CSS_SELECTOR, "span.c1u6gyxh:not(.tx5yyjc)").text.strip()
-        except:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        events.append(json.loads(line))
+                    except ValueError:
+                        # Dòng cuối ghi dở khi process bị kill
+                        break
+        except OSError:
             pass
-        seller = "Ẩn danh"
+        return events
+
+    def load_unfinished(self):
+        # Trạng thái lần chạy cuối nếu nó chưa có run_end, ngược lại None
+        events = self._events()
+        starts = [i for i, e in enumerate(events) if e["event"] == "run_start"]
+        if not starts:
+            return None
+        start = events[starts[-1]]
+        state = {
+            "run": start["run"],
+            "crawl_mode": start["crawl_mode"],
+            "watermark": start["watermark"],
+            "newest_ad_id": start["watermark"],
+            "last_page": 0,
+            "stt": 1,
+            "consecutive_empty": 0,
+            "page_stt_logs": [],
+            "total_new": 0,
+            "total_updated": 0,
+            "crawl_done": False,
+            "pending_alerts": {},
+            # Mọi link đã từng xếp hàng/gửi Telegram trong lần chạy này → resume không báo lại
+            "alerted": set(),
+        }
+        for e in events[starts[-1]:]:
+            kind = e["event"]
+            if kind == "run_end":
+                return None
+            if kind == "page_done":
+                state["last_page"] = e["page"]
+                for key in ("stt", "consecutive_empty", "newest_ad_id", "total_new", "total_updated"):
+                    state[key] = e[key]
+                if e.get("log"):
+                    state["page_stt_logs"].append(e["log"])
+            elif kind == "crawl_done":
+                state["crawl_done"] = True
+            elif kind == "alert_queued":
+                state["pending_alerts"][e["link"]] = e["item"]
+                state["alerted"].add(e["link"])
+            elif kind == "alert_sent":
+                state["pending_alerts"].pop(e["link"], None)
+                state["alerted"].add(e["link"])
+        return state
+
+    def start(self, resume_state=None, **info):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if resume_state is not None:
+            self.run_id = resume_state["run"]
+            self.file = open(self.path, "a", encoding="utf-8")
+            self.record("resume", last_page=resume_state["last_page"])
+        else:
+            # Lần chạy mới: nhật ký cũ không còn cần
+            self.run_id = datetime.now().isoformat(timespec="seconds")
+            self.file = open(self.path, "w", encoding="utf-8")
+            self.record("run_start", **info)
+
+    def record(self, event, **fields):
+        line = json.dumps({"run": self.run_id, "event": event, "at": datetime.now().isoformat(timespec="seconds"),
+                           **fields}, ensure_ascii=False)
+        with self.lock:
+            # Đã close (vd. callback Telegram về muộn) → bỏ qua thay vì lỗi trên thread gửi
+            if self.file is None:
+                return
+            self.file.write(line + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def finish(self):
+        self.record("run_end")
+        self.close()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+class AlertPipeline:
+    # Stage enrich → notify: lấy ảnh chi tiết (song song theo lô) rồi xếp hàng Telegram,
+    # chạy trên thread riêng; hàng đợi có giới hạn → vòng quét chỉ chờ khi tồn quá nhiều
+    def __init__(self, session, maxsize=PIPELINE_QUEUE_SIZE, on_sent=None, chat_id=None):
+        self.session = session
+        self.on_sent = on_sent
+        self.chat_id = chat_id
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.thread = threading.Thread(target=self._run, name="alert-enricher", daemon=True)
+        self.thread.start()
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def _run(self):
+        done = False
+        while not done:
+            batch = [self.queue.get()]
+            while len(batch) < DETAIL_CONCURRENCY:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            # None = hết việc (luôn là phần tử cuối cùng được put)
+            if batch[-1] is None:
+                done = True
+                batch.pop()
+            if not batch:
+                continue
+            try:
+                with RUN_STATS.span("alerts.images"):
+                    send_alerts(batch, self.session, self.on_sent, self.chat_id)
+            except Exception as e:
+                log(f"Lỗi lấy ảnh/gửi tin mới: {e}")
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+class SheetWriter:
+    # Stage ghi sheet: đồng bộ bản chiếu từ store trên thread riêng (connection SQLite riêng).
+    # flush() không chờ; nhiều yêu cầu trong lúc đang ghi dồn thành 1 lần ghi tiếp theo
+    def __init__(self, worksheet, journal=None, store_path=None):
+        self.worksheet = worksheet
+        self.journal = journal
+        self.store_path = store_path
+        self.requests = queue.Queue(maxsize=1)
+        self.written = 0
+        self.failed = False
+        self.thread = threading.Thread(target=self._run, name="sheet-writer", daemon=True)
+        self.thread.start()
+
+    def flush(self):
         try:
-            seller = item_element.find_element(By.CSS_SELECTOR, "div.dteznpi span.brnpcl3").text.strip()
-        except:
+            self.requests.put_nowait(True)
+        except queue.Full:
             pass
-        views_str = "0"
+
+    def _run(self):
+        store = ListingStore(self.store_path)
         try:
-            views_str = item_element.find_element(By.CSS_SELECTOR, "div.vglk6qt span").text.strip()
-        except:
-            pass
-        views = int(''.join(c for c in views_str if c.isdigit())) if ''.join(c for c in views_str if c.isdigit()) else 0
-        return {
-            "title": title,
-            "price": price,
-            "link": link,
-            "time": time_posted,
-            "location": location,
-            "seller": seller,
-            "views": views,
-            "scraped_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "page": page
-        }
-    except:
-        return None
+            while True:
+                request = self.requests.get()
+                try:
+                    with RUN_STATS.span("sheet.sync"):
+                        written = sync_sheet_projection(self.worksheet, store)
+                    self.written += written
+                    self.failed = False
+                    if self.journal is not None:
+                        self.journal.record("sheet_synced", rows=written)
+                except Exception as e:
+                    # Store vẫn giữ thay đổi; lần ghi sau sẽ ghi lại các dòng chưa đồng bộ
+                    self.failed = True
+                    log(f"Lỗi đồng bộ sheet: {e}")
+                finally:
+                    self.requests.task_done()
+                if request is None:
+                    return
+        finally:
+            store.close()
 
-def scrape_data():
-    log("🚀 BẮT ĐẦU QUÉT CHỢ TỐT - Nhạc cụ Hà Nội ≤ 2.1tr")
-    worksheet = connect_google_sheet()
-    
-    # Đọc dữ liệu hiện tại
+    def close(self):
+        # Ghi lần cuối rồi dừng thread
+        self.requests.put(None)
+        self.thread.join()
+
+def open_searches(searches):
+    # [(search, worksheet, store)]: spreadsheet mở 1 lần, sheet chỉ tải khi store của search cần nạp lại
+    with RUN_STATS.span("sheet.connect"):
+        spreadsheet = open_spreadsheet()
+    targets = []
     try:
-        all_values = worksheet.get_all_values()
-        existing_data = all_values[1:] if len(all_values) > 1 else []
-        
-        # Tạo map: link → row number
-        link_to_row = {}
-        # Tạo set: các title đã tồn tại (để check trùng title)
-        existing_titles = set()
-        # Tạo map: title → list row numbers (nếu title trùng nhiều)
-        title_to_rows = {}
-        
-        for i, row in enumerate(existing_data, start=2):
-            if len(row) >= 4:
-                link = row[3].strip() if len(row) > 3 else ""
-                title = row[1].strip() if len(row) > 1 else ""
-                
-                if link:
-                    link_to_row[link] = i
-                if title:
-                    existing_titles.add(title)
-                    if title not in title_to_rows:
-                        title_to_rows[title] = []
-                    title_to_rows[title].append(i)
-        
-        existing_links = set(link_to_row.keys())
-        log(f"Đọc {len(existing_links)} tin cũ | {len(existing_titles)} title khác nhau từ sheet")
-    except Exception as e:
-        log(f"Lỗi đọc sheet: {e}")
-        existing_links = set()
-        existing_titles = set()
-        link_to_row = {}
-        title_to_rows = {}
+        for search in searches:
+            with RUN_STATS.span("sheet.connect"):
+                worksheet = connect_google_sheet(search["sheet"], spreadsheet)
+            with RUN_STATS.span("store.open"):
+                targets.append((search, worksheet, open_store(worksheet, search["db"])))
+    except Exception:
+        close_searches(targets)
+        raise
+    return targets
+
+def close_searches(targets):
+    for _, _, store in targets:
+        store.close()
+
+def find_in_other_searches(others, link):
+    # Tên search khác đã có tin này (theo ad id) → không báo Telegram lần nữa
+    return next((name for name, store in others if store.has_ad(link)), None)
+
+def scrape_data(resume=False):
+    searches = load_searches()
+    log("🚀 BẮT ĐẦU QUÉT CHỢ TỐT - " + " | ".join(search["name"] for search in searches))
+    targets = open_searches(searches)
+    # Session, nhịp crawl theo host và Chrome dùng chung cho mọi search
+    fetcher = PageFetcher()
+    results = {}
+    try:
+        for search, worksheet, store in targets:
+            others = [(other["name"], other_store) for other, _, other_store in targets if other is not search]
+            if len(targets) > 1:
+                log(f"🔎 Search: {search['name']} → sheet {search['sheet']}")
+            try:
+                with RUN_STATS.search(search["name"]):
+                    results[search["name"]] = scrape_search(search, worksheet, store, fetcher, others, resume)
+            except Exception as e:
+                # 1 search lỗi không chặn các search còn lại; nhật ký chưa có run_end → --resume làm tiếp
+                log(f"Lỗi search {search['name']}: {e}")
+                results[search["name"]] = {"error": str(e)}
+    finally:
+        fetcher.close()
+        close_searches(targets)
     
-    driver = setup_driver()
+    RUN_STATS.info.update(
+        mode="scrape",
+        new=sum(r.get("new", 0) for r in results.values()),
+        updated=sum(r.get("updated", 0) for r in results.values()),
+        pages_processed=sum(r.get("pages_processed", 0) for r in results.values()),
+        searches=results,
+    )
+    errors = [f"{name}: {r['error']}" for name, r in results.items() if "error" in r]
+    if errors:
+        RUN_STATS.info["error"] = "; ".join(errors)
+    RUN_STATS.snapshot_memory("end")
+
+def scrape_search(search, worksheet, store, fetcher, others=(), resume=False):
+    journal = RunJournal(search["journal"])
+    state = journal.load_unfinished()
+    if state is not None and not resume:
+        log(f"⚠️ Lần chạy {state['run']} dừng giữa chừng ở trang {state['last_page']} → quét lại từ đầu "
+            f"(dùng --resume để làm tiếp)")
+        state = None
+    
+    if state is not None:
+        crawl_mode = state["crawl_mode"]
+        watermark = state["watermark"]
+        newest_ad_id = state["newest_ad_id"]
+        log(f"♻️ Tiếp tục lần chạy {state['run']}: chế độ {crawl_mode}, sau trang {state['last_page']}")
+    else:
+        crawl_mode = choose_crawl_mode(store)
+        watermark = int(store.get_meta("watermark_ad_id", "0"))
+        newest_ad_id = watermark
+        log(f"Chế độ quét: {crawl_mode} (watermark ad id {watermark})")
+    journal.start(state, crawl_mode=crawl_mode, watermark=watermark)
+    
+    # Pipeline: fetch (thread pool, tải trước có giới hạn) → extract → classify theo store (thread chính)
+    # → enrich ảnh + notify (AlertPipeline) ; ghi sheet theo chunk (SheetWriter)
+    alert_pipeline = AlertPipeline(fetcher.session, chat_id=search["chat_id"],
+                                   on_sent=lambda item: journal.record("alert_sent", link=item["link"]))
+    sheet_writer = SheetWriter(worksheet, journal, search["db"])
+    max_pages = search["max_pages"]
     total_new = 0
     total_updated = 0
-    page = 1
     consecutive_empty = 0
     global_stt_counter = 1
     page_stt_logs = []
-    batch_updates = []
-    new_rows = []
+    pages_since_flush = 0
+    first_page = 1
+    alerted = set()
     
-    while page <= MAX_PAGES:
-        url = START_URL if page == 1 else f"{START_URL}&page={page}"
-        log(f"Trang {page} → {url}")
-        
-        try:
-            driver.get(url)
-            WebDriverWait(driver, 15).until(EC.presence_of_element_located((By.CSS_SELECTOR, "li.a14axl8t")))
-        except Exception as e:
-            log(f"Load trang {page} lỗi: {e}")
-            if page_has_no_results(driver):
-                break
-            consecutive_empty += 1
-            if consecutive_empty >= MAX_CONSECUTIVE_EMPTY:
+    if state is not None:
+        total_new = state["total_new"]
+        total_updated = state["total_updated"]
+        consecutive_empty = state["consecutive_empty"]
+        global_stt_counter = state["stt"]
+        page_stt_logs = state["page_stt_logs"]
+        alerted = state["alerted"]
+        # Đã quét xong trước khi dừng → chỉ còn gửi tin + ghi sheet
+        first_page = max_pages + 1 if state["crawl_done"] else state["last_page"] + 1
+        # Tin đã xếp hàng nhưng chưa gửi; tin của trang chưa commit sẽ được phát hiện lại khi quét trang đó
+        pending = [item for link, item in state["pending_alerts"].items() if store.find(link) is not None]
+        if pending:
+            log(f"Gửi lại {len(pending)} tin mới chưa kịp gửi Telegram")
+        for item in pending:
+            alert_pipeline.put(item)
+    
+    def queue_alerts(page_alerts):
+        # Chỉ gọi sau store.commit() của trang: trang chưa commit thì chưa báo gì,
+        # resume quét lại trang đó sẽ phát hiện lại đúng các tin này
+        for data in page_alerts:
+            if others:
+                data["search"] = search["name"]
+            journal.record("alert_queued", link=data["link"], item=data)
+            alerted.add(data["link"])
+            alert_pipeline.put(data)
+    
+    def page_done(page, log_line=None):
+        journal.record("page_done", page=page, stt=global_stt_counter, consecutive_empty=consecutive_empty,
+                       newest_ad_id=newest_ad_id, total_new=total_new, total_updated=total_updated, log=log_line)
+    
+    def fetch_page(page, stop):
+        # Chạy trên thread của crawl_pages → gắn search cho số đo từng trang
+        with RUN_STATS.search(search["name"]):
+            return fetcher.fetch(page, stop, search["url"])
+    
+    if crawl_mode == "incremental":
+        # Thường chỉ cần 1–2 trang → không tải trước các trang sau
+        pages = crawl_pages(fetch_page, max_pages, concurrency=1, first_page=first_page)
+    else:
+        pages = crawl_pages(fetch_page, max_pages, first_page=first_page)
+    crawl_started = time.perf_counter()
+    try:
+        for page, status, items in pages:
+            if status == "no_results":
                 break
-            page += 1
-            time.sleep(SLEEP_BETWEEN_PAGES)
-            continue
-        
-        if page_has_no_results(driver):
-            break
-        
-        items = driver.find_elements(By.CSS_SELECTOR, "li.a14axl8t")
-        log(f"Trang {page}: Tìm thấy {len(items)} tin")
-        page_stt_start = global_stt_counter
-        page_item_count = 0
-        
-        for item_el in items:
-            data = extract_item_data(item_el, page)
-            if not data:
+            if status == "failed":
+                consecutive_empty += 1
+                page_done(page)
+                if consecutive_empty >= MAX_CONSECUTIVE_EMPTY:
+                    break
                 continue
             
-            link = data["link"]
-            title = data["title"]
-            page_item_count += 1
-            current_stt = global_stt_counter
-            global_stt_counter += 1
-            
-            row_data = [
-                str(current_stt),
-                title,
-                data["price"],
-                link,
-                data["time"],
-                data["location"],
-                data["seller"],
-                str(data["views"]),
-                str(page)
-            ]
+            log(f"Trang {page}: Tìm thấy {len(items)} tin")
+            process_started = time.perf_counter()
+            reached_watermark = crawl_mode == "incremental" and page_is_known(store, items, watermark)
+            for data in items:
+                ad_id = extract_ad_id(data["link"])
+                if ad_id is not None and ad_id > newest_ad_id:
+                    newest_ad_id = ad_id
+            page_stt_start = global_stt_counter
+            page_item_count = 0
+            page_alerts = []
             
-            # ────────────────────────────────────────────────
-            # Logic mới: Chỉ check tin mới ở trang 1
-            # Chỉ gửi Telegram nếu CẢ title VÀ link đều KHÔNG trùng
-            # ────────────────────────────────────────────────
-            if page == 1:
-                title_exists = title in existing_titles
-                link_exists = link in existing_links
+            for data in items:
+                link = data["link"]
+                title = data["title"]
+                page_item_count += 1
+                current_stt = global_stt_counter
+                global_stt_counter += 1
                 
-                if link_exists:
-                    # Link đã tồn tại → tin cũ → update STT/Views/Hidden
-                    row_num = link_to_row[link]
-                    batch_updates.append({"range": f"A{row_num}", "values": [[str(current_stt)]]})
-                    batch_updates.append({"range": f"H{row_num}", "values": [[str(data["views"])]]})
-                    batch_updates.append({"range": f"I{row_num}", "values": [[str(page)]]})
+                seen_at = datetime.now().isoformat(timespec="seconds")
+                kind = record_listing(store, data, current_stt, page, seen_at)
+                if kind == "updated":
                     total_updated += 1
-                    log(f"Trang 1 - Update tin cũ (link trùng): {title[:40]}...")
-                
-                elif title_exists:
-                    # Title trùng nhưng link mới → KHÔNG coi là mới, KHÔNG gửi Telegram
-                    # Nhưng vẫn thêm vào sheet như tin mới (vì link khác)
-                    new_rows.append(row_data)
+                    log(f"Trang {page} - Update tin cũ: {title[:40]}...")
+                elif kind == "repost":
                     total_new += 1
-                    existing_links.add(link)
-                    existing_titles.add(title)  # Cập nhật set title
-                    log(f"Trang 1 - Title trùng nhưng link mới (không gửi Tele): {title[:40]}...")
-                
-                else:
-                    # Cả title VÀ link đều không trùng → TIN MỚI → gửi Telegram
-                    images = get_images_from_detail(link)
-                    send_telegram_with_media(data, images)
-                    new_rows.append(row_data)
+                    log(f"Trang 1 - Tin đăng lại (title trùng/gần trùng, không gửi Tele): {title[:40]}...")
+                elif kind == "new":
                     total_new += 1
-                    existing_links.add(link)
-                    existing_titles.add(title)
-                    log(f"Trang 1 - TIN MỚI (title + link mới) → Gửi Tele: {title[:40]}...")
+                    seen_in = find_in_other_searches(others, link)
+                    if seen_in:
+                        log(f"Trang 1 - Tin đã có ở search {seen_in} (không gửi Tele lại): {title[:40]}...")
+                    elif link in alerted:
+                        log(f"Trang {page} - Tin đã báo Tele trước khi dừng (không gửi lại): {title[:40]}...")
+                    else:
+                        # Lấy ảnh + gửi Telegram ở stage sau (sau khi commit trang), không chặn vòng quét
+                        page_alerts.append(data)
+                        log(f"Trang 1 - TIN MỚI (title + link mới) → Gửi Tele: {title[:40]}...")
+            RUN_STATS.record("page.process", time.perf_counter() - process_started, page)
             
+            with RUN_STATS.span("store.commit", page):
+                store.commit()
+            queue_alerts(page_alerts)
+            pages_since_flush += 1
+            if SHEET_FLUSH_PAGES and pages_since_flush >= SHEET_FLUSH_PAGES:
+                sheet_writer.flush()
+                pages_since_flush = 0
+            
+            if page_item_count > 0:
+                page_stt_logs.append(
+                    f"Trang {page}: {page_item_count} tin, STT từ {page_stt_start} → {global_stt_counter-1}"
+                )
             else:
-                # Trang >=2: chỉ update nếu link đã tồn tại (không check title, không gửi Tele)
-                if link in existing_links:
-                    row_num = link_to_row[link]
-                    batch_updates.append({"range": f"A{row_num}", "values": [[str(current_stt)]]})
-                    batch_updates.append({"range": f"H{row_num}", "values": [[str(data["views"])]]})
-                    batch_updates.append({"range": f"I{row_num}", "values": [[str(page)]]})
-                    total_updated += 1
-                    log(f"Trang {page} - Update tin cũ: {title[:40]}...")
-        
-        if page_item_count > 0:
-            page_stt_logs.append(
-                f"Trang {page}: {page_item_count} tin, STT từ {page_stt_start} → {global_stt_counter-1}"
-            )
-        else:
-            page_stt_logs.append(f"Trang {page}: Không có tin nào")
-        
-        if page_item_count == 0:
-            consecutive_empty += 1
-        else:
-            consecutive_empty = 0
-        
-        page += 1
-        time.sleep(SLEEP_BETWEEN_PAGES)
-    
-    driver.quit()
+                page_stt_logs.append(f"Trang {page}: Không có tin nào")
+            
+            if page_item_count == 0:
+                consecutive_empty += 1
+            else:
+                consecutive_empty = 0
+            page_done(page, page_stt_logs[-1])
+            
+            if reached_watermark:
+                log(f"Trang {page}: toàn tin đã biết → dừng quét tăng dần")
+                break
+        journal.record("crawl_done")
+    finally:
+        # Dừng sớm/lỗi: huỷ các trang chưa tải, gửi nốt tin mới đã xếp hàng
+        pages.close()
+        alert_pipeline.close()
+        # Trang đang xử lý dở thì bỏ (resume/lần sau quét lại); các trang đã commit vẫn được ghi nốt lên sheet.
+        # Lần ghi cuối: chỉ các dòng đổi nội dung/vị trí (Page ↑ → STT ↑)
+        store.rollback()
+        log("Đồng bộ sheet từ store...")
+        sheet_writer.close()
+    RUN_STATS.record("crawl", time.perf_counter() - crawl_started)
+    RUN_STATS.snapshot_memory("after_crawl")
     
     # Log thống kê
     log("=== THỐNG KÊ ĐÁNH STT THEO TỪNG TRANG ===")
@@ -395,49 +1832,177 @@ def scrape_data():
         log(log_line)
     log(f"Tổng STT đã đánh: 1 → {global_stt_counter-1}")
     
-    # Batch update tin cũ
-    if batch_updates:
-        try:
-            worksheet.batch_update(batch_updates)
-            log(f"Đã batch update {len(batch_updates)//3} tin cũ (STT + Views + Hidden)")
-        except Exception as e:
-            log(f"Lỗi batch update: {e}")
+    if newest_ad_id > watermark:
+        store.set_meta("watermark_ad_id", newest_ad_id)
+    if crawl_mode == "full" and page_stt_logs:
+        store.set_meta("last_full_refresh", datetime.now().isoformat(timespec="seconds"))
+    store.commit()
     
-    # Append tin mới (chỉ từ trang 1, và đã lọc theo logic title+link)
-    if new_rows:
-        try:
-            worksheet.append_rows(new_rows)
-            log(f"Đã thêm {len(new_rows)} tin mới vào sheet")
-        except Exception as e:
-            log(f"Lỗi append rows: {e}")
+    if not sheet_writer.failed:
+        log(f"Đã ghi {sheet_writer.written}/{store.count()} dòng lên sheet")
+    # alert_sent của search này phải vào nhật ký trước run_end; job chết giữa chừng thì --resume gửi lại
+    flush_telegram_sender()
+    journal.finish()
+    
+    log(f"Hoàn thành: +{total_new} mới | ↑{total_updated} cập nhật | Tổng STT cuối: {global_stt_counter-1}")
+    return {"crawl_mode": crawl_mode, "new": total_new, "updated": total_updated,
+            "pages_processed": len(page_stt_logs)}
+
+class PollScheduler:
+    # EWMA số tin mới/phút theo từng giờ trong ngày → giờ nhiều tin (tối) poll dày, đêm poll thưa
+    def __init__(self, rates=None):
+        self.rates = dict(rates or {})
+
+    def record(self, hour, new_count, minutes):
+        rate = new_count / max(minutes, 1.0)
+        previous = self.rates.get(str(hour))
+        self.rates[str(hour)] = rate if previous is None else previous + WATCH_RATE_ALPHA * (rate - previous)
+
+    def interval(self, hour):
+        rate = self.rates.get(str(hour))
+        if rate is None:
+            return WATCH_DEFAULT_INTERVAL
+        if rate <= 0:
+            return WATCH_MAX_INTERVAL
+        seconds = 60 * WATCH_TARGET_NEW_PER_POLL / rate
+        return min(WATCH_MAX_INTERVAL, max(WATCH_MIN_INTERVAL, seconds))
+
+def watch(max_hours=WATCH_MAX_HOURS):
+    searches = load_searches()
+    log(f"👀 WATCH MODE - poll trang 1 của {len(searches)} search trong {max_hours}h")
+    targets = open_searches(searches)
+    # Nhịp poll chung cho mọi search (các search chung host → chung giới hạn); lưu ở store đầu tiên
+    scheduler = PollScheduler(json.loads(targets[0][2].get_meta("watch_rates", "{}")))
+    # Giữ session (và Chrome nếu phải fallback) suốt phiên
+    fetcher = PageFetcher()
+    deadline = time.monotonic() + max_hours * 3600
+    last_poll = None
+    last_sync = {search["name"]: time.monotonic() for search in searches}
+    unsynced = set()
+    # Search có tin mới chưa lên sheet → đồng bộ sau WATCH_SYNC_NEW_SECONDS thay vì WATCH_SYNC_SECONDS
+    pending_new = set()
+    total_new = 0
     
-    # Sort lại toàn bộ sheet
-    log("Bắt đầu sắp xếp lại toàn bộ sheet...")
     try:
-        all_data = worksheet.get_all_values()
-        if len(all_data) <= 1:
-            log("Sheet trống hoặc chỉ có header → bỏ qua sort")
-        else:
-            header = all_data[0]
-            data_rows = all_data[1:]
-            sorted_rows = sorted(
-                data_rows,
-                key=lambda row: (
-                    int(row[8]) if row[8].isdigit() else 999999 if row[8] == "Hidden" else 0,
-                    int(row[0]) if row[0].isdigit() else 999999
-                )
-            )
-            worksheet.clear()
-            worksheet.append_row(header)
-            worksheet.append_rows(sorted_rows)
-            log(f"Đã sort lại {len(sorted_rows)} dòng (Page ↑ → STT ↑)")
-    except Exception as e:
-        log(f"Lỗi khi sort sheet: {e}")
+        while time.monotonic() < deadline:
+            polled_at = time.monotonic()
+            statuses = []
+            poll_new = 0
+            for search, worksheet, store in targets:
+                name = search["name"]
+                others = [(other["name"], other_store) for other, _, other_store in targets if other is not search]
+                try:
+                    with RUN_STATS.search(name), RUN_STATS.span("watch.poll"):
+                        status, items = fetcher.fetch(1, start_url=search["url"])
+                except Exception as e:
+                    log(f"Lỗi tải trang 1 ({name}): {e}")
+                    status, items = "failed", []
+                statuses.append(status)
+                if status != "ok":
+                    continue
+                
+                seen_at = datetime.now().isoformat(timespec="seconds")
+                alerts = []
+                for stt, data in enumerate(items, start=1):
+                    kind = record_listing(store, data, stt, 1, seen_at)
+                    if kind == "new":
+                        seen_in = find_in_other_searches(others, data["link"])
+                        if seen_in:
+                            log(f"Tin đã có ở search {seen_in} (không gửi Tele lại): {data['title'][:40]}...")
+                        else:
+                            if others:
+                                data["search"] = name
+                            alerts.append(data)
+                            log(f"TIN MỚI → Gửi Tele: {data['title'][:40]}...")
+                    elif kind == "repost":
+                        log(f"Tin đăng lại (title trùng/gần trùng, không gửi Tele): {data['title'][:40]}...")
+                    if kind is not None:
+                        unsynced.add(name)
+                if alerts:
+                    pending_new.add(name)
+                    with RUN_STATS.span("alerts.images"):
+                        send_alerts(alerts, fetcher.session, chat_id=search["chat_id"])
+                    poll_new += len(alerts)
+                store.commit()
+                
+                since_sync = time.monotonic() - last_sync[name]
+                if name in unsynced and (since_sync >= WATCH_SYNC_SECONDS
+                                         or (name in pending_new and since_sync >= WATCH_SYNC_NEW_SECONDS)):
+                    try:
+                        with RUN_STATS.span("sheet.sync"):
+                            written = sync_sheet_projection(worksheet, store)
+                        log(f"Đã ghi {written} dòng lên sheet {search['sheet']}")
+                        unsynced.discard(name)
+                        pending_new.discard(name)
+                    except Exception as e:
+                        log(f"Lỗi đồng bộ sheet {search['sheet']}: {e}")
+                    last_sync[name] = time.monotonic()
+            
+            total_new += poll_new
+            if "ok" in statuses:
+                if last_poll is not None:
+                    scheduler.record(datetime.now().hour, poll_new, (polled_at - last_poll) / 60)
+                last_poll = polled_at
+                targets[0][2].set_meta("watch_rates", json.dumps(scheduler.rates))
+                targets[0][2].commit()
+            
+            delay = scheduler.interval(datetime.now().hour)
+            if any(status != "ok" for status in statuses):
+                delay = min(WATCH_MAX_INTERVAL, delay * 2)
+            delay *= random.uniform(0.9, 1.1)
+            delay = max(0, min(delay, deadline - time.monotonic()))
+            log(f"Trang 1: {', '.join(statuses)} | poll lại sau {delay:.0f}s")
+            time.sleep(delay)
+    finally:
+        for search, worksheet, store in targets:
+            if search["name"] not in unsynced:
+                continue
+            try:
+                sync_sheet_projection(worksheet, store)
+            except Exception as e:
+                log(f"Lỗi đồng bộ sheet {search['sheet']}: {e}")
+        fetcher.close()
+        close_searches(targets)
     
-    log(f"Hoàn thành: +{total_new} mới | ↑{total_updated} cập nhật | Tổng STT cuối: {global_stt_counter-1}")
+    RUN_STATS.info.update(mode="watch", new=total_new)
+    RUN_STATS.snapshot_memory("end")
+    log(f"Kết thúc watch: +{total_new} tin mới đã gửi")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quét Chợ Tốt và báo tin mới qua Telegram")
+    parser.add_argument("--watch", action="store_true", help="Chạy liên tục, poll trang 1 với khoảng cách tự điều chỉnh")
+    parser.add_argument("--resume", action="store_true",
+                        help="Làm tiếp lần chạy trước nếu nó dừng giữa chừng (theo nhật ký .cache)")
+    parser.add_argument("--watch-hours", type=float, default=WATCH_MAX_HOURS, help="Thời gian tối đa của --watch (giờ)")
+    parser.add_argument("--report", default=RUN_REPORT_PATH, help="File JSON báo cáo thời gian/lời gọi/bộ nhớ")
+    parser.add_argument("--profile", nargs="?", const=".cache/scrape_chotot.prof", default=None,
+                        help="Ghi cProfile (thread chính) ra file, mặc định .cache/scrape_chotot.prof")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Bật tracemalloc để báo cáo có top dòng cấp phát (chậm hơn)")
+    args = parser.parse_args()
+    if args.trace_memory:
+        tracemalloc.start()
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
     try:
-        scrape_data()
+        if args.watch:
+            watch(args.watch_hours)
+        else:
+            scrape_data(resume=args.resume)
     except Exception as e:
+        RUN_STATS.info["error"] = str(e)
         log(f"Lỗi chính: {e}")
+    finally:
+        # Tin đã xếp hàng vẫn được gửi hết kể cả khi quét lỗi giữa chừng
+        with RUN_STATS.span("telegram.flush"):
+            close_telegram_sender()
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(os.path.dirname(args.profile) or ".", exist_ok=True)
+            profiler.dump_stats(args.profile)
+            log(f"Đã ghi cProfile: {args.profile}")
+        try:
+            RUN_STATS.write(args.report)
+        except OSError as e:
+            log(f"Không ghi được báo cáo: {e}")